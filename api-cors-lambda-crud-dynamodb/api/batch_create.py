@@ -0,0 +1,65 @@
+import os
+
+import db
+import encoding
+import metrics
+import batching
+from create import new_item
+
+TABLE_NAME = os.environ.get('TABLE_NAME', '')
+PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', '1000'))
+
+@metrics.instrumented
+def handler(event, context):
+
+    try:
+        body = encoding.read_body(event)
+        if body is None:
+            raise ValueError("invalid request, you are missing the parameter body")
+
+        entries = encoding.loads(body)
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("invalid request, body must be a non-empty JSON array of items")
+        if len(entries) > MAX_BATCH_ITEMS:
+            raise ValueError(f"invalid request, at most {MAX_BATCH_ITEMS} items per batch")
+
+        results = [None] * len(entries)
+        items = []
+        for (index, entry) in enumerate(entries):
+            if not isinstance(entry, dict):
+                results[index] = {"index": index, "status": "rejected", "description": "item must be a JSON object"}
+                continue
+            item = new_item(entry)
+            try:
+                batching.check_item(item)
+            except ValueError as e:
+                results[index] = {"index": index, "status": "rejected", "description": str(e)}
+                continue
+            items.append((index, item))
+
+        errors = batching.batch_write_items(
+            db.get_client(), TABLE_NAME, [ item for (_, item) in items ], PRIMARY_KEY
+        )
+
+        for (index, item) in items:
+            key = item[PRIMARY_KEY]
+            if errors[key] is None:
+                results[index] = {"index": index, PRIMARY_KEY: key, "status": "created"}
+            else:
+                results[index] = {"index": index, "status": "failed", "description": errors[key]}
+
+        # 207 tells the client to look at the per-item results
+        all_created = all(result["status"] == "created" for result in results)
+        status_code = 201 if all_created else 207
+        resp = {"results": results}
+
+    except ValueError as e:
+        status_code = 400
+        resp = {"description": f"Bad request. {str(e)}"}
+
+    except Exception as e:
+        status_code = 500
+        resp = {"description": f"Internal server error. {str(e)}"}
+
+    return encoding.build_response(event, status_code, resp)
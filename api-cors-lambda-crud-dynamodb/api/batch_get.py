@@ -0,0 +1,81 @@
+import os
+
+import db
+import encoding
+import metrics
+import batching
+import projection
+from expressions import ExpressionBuilder
+
+TABLE_NAME = os.environ.get('TABLE_NAME', '')
+PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
+MAX_BATCH_GET_IDS = int(os.environ.get('MAX_BATCH_GET_IDS', '1000'))
+
+def get_items(ids, fields=None):
+    """
+    Look up the given ids with BatchGetItem and return one result per id, in
+    request order. Ids may repeat; each distinct id is only read once.
+    With `fields`, only those attributes of each item are returned.
+    """
+    if not ids:
+        raise ValueError("invalid request, no ids provided")
+    if len(ids) > MAX_BATCH_GET_IDS:
+        raise ValueError(f"invalid request, at most {MAX_BATCH_GET_IDS} ids per request")
+    if not all(isinstance(item_id, str) and item_id for item_id in ids):
+        raise ValueError("invalid request, ids must be non-empty strings")
+
+    kwargs = {}
+    if fields:
+        # the primary key is needed to match the items to the ids
+        builder = ExpressionBuilder()
+        kwargs.update(projection.projection_params(builder, fields, required=[PRIMARY_KEY]))
+        kwargs.update(builder.params())
+
+    distinct_ids = list(dict.fromkeys(ids)) # BatchGetItem rejects duplicate keys
+    found, failed = batching.batch_get_items(db.get_client(), TABLE_NAME, distinct_ids, PRIMARY_KEY, **kwargs)
+
+    results = []
+    for item_id in ids:
+        if item_id in found:
+            item = found[item_id]
+            if fields and PRIMARY_KEY not in fields:
+                item = {k: v for (k, v) in item.items() if k != PRIMARY_KEY}
+            results.append({PRIMARY_KEY: item_id, "status": "found", "item": item})
+        elif item_id in failed:
+            results.append({PRIMARY_KEY: item_id, "status": "failed", "description": failed[item_id]})
+        else:
+            results.append({PRIMARY_KEY: item_id, "status": "missing"})
+
+    return results
+
+@metrics.instrumented
+def handler(event, context):
+
+    try:
+        body = encoding.read_body(event)
+        if body is None:
+            raise ValueError("invalid request, you are missing the parameter body")
+
+        request = encoding.loads(body)
+        ids = request.get("ids", None) if isinstance(request, dict) else None
+        if not isinstance(ids, list):
+            raise ValueError("invalid request, body must be a JSON object with a list of ids")
+
+        fields = request.get("fields", None)
+        if fields is not None:
+            if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+                raise ValueError("invalid request, fields must be a list of attribute paths")
+            fields = projection.parse_fields({"fields": ",".join(fields)})
+
+        status_code = 200
+        resp = {"results": get_items(ids, fields)}
+
+    except ValueError as e:
+        status_code = 400
+        resp = {"description": f"Bad request. {str(e)}"}
+
+    except Exception as e:
+        status_code = 500
+        resp = {"description": f"Internal server error. {str(e)}"}
+
+    return encoding.build_response(event, status_code, resp)
@@ -0,0 +1,135 @@
+import decimal, os, random, time
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+
+BATCH_WRITE_SIZE = 25 # BatchWriteItem limit
+BATCH_GET_SIZE = 100 # BatchGetItem limit
+BATCH_MAX_ATTEMPTS = int(os.environ.get('BATCH_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('BATCH_BACKOFF_BASE_SECONDS', '0.05'))
+BACKOFF_MAX_SECONDS = float(os.environ.get('BATCH_BACKOFF_MAX_SECONDS', '2'))
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def chunked(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def backoff(attempt):
+    """
+    Sleep before retry number `attempt` (1-based), using exponential backoff
+    with full jitter.
+    """
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    time.sleep(random.uniform(0, delay))
+
+
+def serialize_item(item):
+    return { k: _serializer.serialize(v) for (k, v) in item.items() }
+
+
+def check_item(item):
+    """
+    Raise ValueError if `item` cannot be stored, e.g. a number with more
+    than the 38 significant digits DynamoDB keeps, so that one such item
+    is reported on its own instead of failing the batch it is written in.
+    """
+    try:
+        serialize_item(item)
+    except TypeError as e:
+        raise ValueError(f"item cannot be stored: {str(e)}")
+    except decimal.DecimalException:
+        raise ValueError("item cannot be stored: numbers can have at most 38 significant digits")
+
+
+def deserialize_item(item):
+    return { k: _deserializer.deserialize(v) for (k, v) in item.items() }
+
+
+def batch_write_items(client, table_name, items, primary_key):
+    """
+    Put `items` with BatchWriteItem, 25 at a time, retrying UnprocessedItems
+    with jittered exponential backoff.
+
+    Returns a dict mapping each item's key to None (written) or to an error
+    message. Every item must carry a distinct `primary_key`.
+    """
+    results = {}
+
+    for chunk in chunked(items, BATCH_WRITE_SIZE):
+        pending = [ { "PutRequest": { "Item": serialize_item(item) } } for item in chunk ]
+        attempt = 0
+        error = "unprocessed after retries"
+
+        while pending and attempt < BATCH_MAX_ATTEMPTS:
+            if attempt > 0:
+                backoff(attempt)
+            attempt += 1
+
+            try:
+                response = client.batch_write_item(RequestItems={ table_name: pending })
+            except client.exceptions.ProvisionedThroughputExceededException as e:
+                # the whole request was throttled; retry all of it
+                error = str(e)
+                continue
+            except ClientError as e:
+                # e.g. a validation error: retrying will not help
+                error = str(e)
+                break
+
+            pending = response.get('UnprocessedItems', {}).get(table_name, [])
+
+        unprocessed = set(
+            request["PutRequest"]["Item"][primary_key]["S"] for request in pending
+        )
+        for item in chunk:
+            key = item[primary_key]
+            results[key] = error if key in unprocessed else None
+
+    return results
+
+
+def batch_get_items(client, table_name, keys, primary_key, **kwargs):
+    """
+    Fetch the items with the given (distinct, string) keys with BatchGetItem,
+    100 at a time, retrying UnprocessedKeys with jittered exponential backoff.
+    Extra kwargs (e.g. ProjectionExpression) go into the per-table request.
+
+    Returns (found, failed): found maps key to item; failed maps the keys
+    that could not be read to an error message. Keys in neither dict do not
+    exist in the table.
+    """
+    found = {}
+    failed = {}
+
+    for chunk in chunked(keys, BATCH_GET_SIZE):
+        pending = {
+            table_name: dict(kwargs, Keys=[ { primary_key: { "S": key } } for key in chunk ])
+        }
+        attempt = 0
+        error = "unprocessed after retries"
+
+        while pending and attempt < BATCH_MAX_ATTEMPTS:
+            if attempt > 0:
+                backoff(attempt)
+            attempt += 1
+
+            try:
+                response = client.batch_get_item(RequestItems=pending)
+            except client.exceptions.ProvisionedThroughputExceededException as e:
+                error = str(e)
+                continue
+
+            for item in response.get('Responses', {}).get(table_name, []):
+                item = deserialize_item(item)
+                found[item[primary_key]] = item
+
+            pending = response.get('UnprocessedKeys', {})
+
+        for key in pending.get(table_name, {}).get('Keys', []):
+            failed[key[primary_key]["S"]] = error
+
+    return found, failed
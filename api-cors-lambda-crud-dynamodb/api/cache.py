@@ -0,0 +1,96 @@
+import hashlib, json, os, time
+from collections import OrderedDict
+
+import projection
+
+# In-container read-through cache for single items.
+#
+# Entries live in the memory of one Lambda container, so other containers
+# can change an item behind our back. Entries are therefore only trusted for
+# ITEM_CACHE_TTL_SECONDS; after that they are revalidated by reading just the
+# item's `version` attribute, which create.py and update_one.py maintain.
+
+ITEM_CACHE_MAX_ENTRIES = int(os.environ.get('ITEM_CACHE_MAX_ENTRIES', '1000'))
+ITEM_CACHE_TTL_SECONDS = float(os.environ.get('ITEM_CACHE_TTL_SECONDS', '5'))
+
+VERSION_ATTRIBUTE = 'version'
+
+
+class ItemCache:
+    """
+    A bounded LRU cache whose entries go stale after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (item, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns (item, fresh), or (None, False) if the key is not cached.
+        """
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None, False
+
+        self.entries.move_to_end(key)
+        item, expires_at = entry
+        return item, time.monotonic() < expires_at
+
+    def put(self, key, item):
+        self.entries[key] = (item, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def evict(self, key):
+        self.entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "size": len(self.entries)
+        }
+
+
+item_cache = ItemCache(ITEM_CACHE_MAX_ENTRIES, ITEM_CACHE_TTL_SECONDS)
+
+
+def make_etag(item_id, item, fields=None):
+    """
+    A strong ETag for an item, or for the projection of it on `fields`.
+    Versioned items are identified by their version; items written before
+    versioning existed fall back to a hash of their content.
+    """
+    version = item.get(VERSION_ATTRIBUTE, None)
+    if version is not None:
+        seed = f"{item_id}:{version}"
+        if fields:
+            seed += ":" + ",".join(fields)
+    else:
+        if fields:
+            item = projection.project_item(item, fields)
+        seed = json.dumps(item, sort_keys=True, default=str)
+    return '"' + hashlib.sha1(seed.encode('utf-8')).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    True if the value of an If-None-Match header matches `etag`.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    tags = [ tag.strip() for tag in if_none_match.split(',') ]
+    return etag in [ tag[2:] if tag.startswith('W/') else tag for tag in tags ]
@@ -0,0 +1,33 @@
+import json, os
+from concurrent.futures import ThreadPoolExecutor
+
+import batching
+import response_cache
+
+# Consumer of the items table's stream, deployed with the stage cache:
+# drops the GET /items/{id} entries of the items that changed (see
+# response_cache.py). Being off the request path, it does not add to the
+# latency of the writes, and it also sees the writes that do not go through
+# PATCH or DELETE (batch writes, imports). An entry may still be served for
+# the second or so the change takes to reach the stream.
+#
+# Nothing is raised: an entry that could not be dropped expires with its TTL.
+
+PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
+INVALIDATION_CONCURRENCY = int(os.environ.get('RESPONSE_CACHE_INVALIDATION_CONCURRENCY', '8'))
+
+
+def changed_ids(records):
+    ids = [ batching.deserialize_item(record["dynamodb"]["Keys"])[PRIMARY_KEY] for record in records ]
+    return list(dict.fromkeys(ids))
+
+
+def handler(event, context):
+    records = event.get("Records", [])
+    ids = changed_ids(records)
+
+    signing_credentials = response_cache.credentials()
+    with ThreadPoolExecutor(max_workers=INVALIDATION_CONCURRENCY) as executor:
+        results = list(executor.map(lambda item_id: response_cache.invalidate_item(item_id, signing_credentials), ids))
+
+    print(json.dumps({ "records": len(records), "items": len(ids), "failed": results.count(False) }))
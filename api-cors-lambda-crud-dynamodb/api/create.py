@@ -1,22 +1,30 @@
-import json, os
+import os
 import uuid
-import boto3
+import db
+import encoding
+import metrics
+import cache
 
 TABLE_NAME = os.environ.get('TABLE_NAME', '')
 PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
 
+def new_item(item):
+    # every new item gets a random key, whatever the client sent, and starts at version 1
+    item[PRIMARY_KEY] = uuid.uuid4().hex
+    item[cache.VERSION_ATTRIBUTE] = 1
+    return item
+
+@metrics.instrumented
 def handler(event, context):
     
     try:
-        body = event.get("body", None)
+        body = encoding.read_body(event)
         if body is None:
             raise ValueError("invalid request, you are missing the parameter body")
         
-        item = json.loads(body)
-        item[PRIMARY_KEY] = uuid.uuid4().hex
+        item = new_item(encoding.loads(body))
 
-        ddb = boto3.resource('dynamodb')
-        table = ddb.Table(TABLE_NAME)
+        table = db.get_table(TABLE_NAME)
         response = table.put_item(Item=item)
 
         status_code = 201
@@ -30,4 +38,4 @@ def handler(event, context):
         status_code = 500
         resp = {"description": str(e)}
     
-    return { "statusCode": status_code, "body": json.dumps(resp) }
\ No newline at end of file
+    return encoding.build_response(event, status_code, resp)
\ No newline at end of file
@@ -0,0 +1,202 @@
+import os, time
+import boto3
+from botocore.config import Config
+
+import metrics
+
+# Shared DynamoDB access for all handlers.
+#
+# Everything here is created lazily, once per Lambda container, and reused by
+# every later (warm) invocation: the session, endpoint resolution, credentials
+# and the HTTP connection pool are not rebuilt on each request.
+#
+# Tunables (environment variables):
+#   DDB_ENDPOINT_URL         talk to a local stand-in, e.g. http://localhost:8000
+#   DDB_MAX_POOL_CONNECTIONS size of the keep-alive connection pool (default 10)
+#   DDB_CONNECT_TIMEOUT      seconds (default 1)
+#   DDB_READ_TIMEOUT         seconds (default 2)
+#   DDB_MAX_ATTEMPTS         total attempts, including the first one (default 3)
+#   DDB_RETRY_MODE           botocore retry mode: legacy, standard or adaptive (default standard)
+#   DDB_PREWARM              "true" to build the client and open a connection at import time
+#   DAX_ENDPOINT             DAX cluster endpoint (e.g. dax://my-cluster.xxx.dax-clusters...:8111)
+#                            for the read path, see get_read_table()
+#   DAX_RETRY_SECONDS        how long to skip DAX after it failed (default 30)
+
+_session = None
+_resource = None
+_client = None
+_tables = {}
+_aws_clients = {}
+
+DAX_ENDPOINT = os.environ.get('DAX_ENDPOINT', '')
+DAX_RETRY_SECONDS = float(os.environ.get('DAX_RETRY_SECONDS', '30'))
+
+# amazondax is heavy to import, so only functions that use DAX pay for it.
+# Without it, a function given a DAX endpoint fails rather than quietly
+# reading from DynamoDB (the stack refuses to deploy DAX without it)
+if DAX_ENDPOINT:
+    from amazondax import AmazonDaxClient
+
+_dax = None
+_dax_down_until = 0.0
+_read_tables = {}
+
+
+def _config():
+    options = {
+        "max_pool_connections": int(os.environ.get('DDB_MAX_POOL_CONNECTIONS', '10')),
+        "connect_timeout": float(os.environ.get('DDB_CONNECT_TIMEOUT', '1')),
+        "read_timeout": float(os.environ.get('DDB_READ_TIMEOUT', '2')),
+        "retries": {
+            "max_attempts": int(os.environ.get('DDB_MAX_ATTEMPTS', '3')),
+            "mode": os.environ.get('DDB_RETRY_MODE', 'standard')
+        }
+    }
+    try:
+        return Config(tcp_keepalive=True, **options)
+    except TypeError:
+        # botocore bundled with older Lambda runtimes does not know tcp_keepalive
+        return Config(**options)
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_resource():
+    global _resource
+    if _resource is None:
+        _resource = _get_session().resource(
+            'dynamodb',
+            endpoint_url=os.environ.get('DDB_ENDPOINT_URL', None) or None,
+            config=_config()
+        )
+        metrics.instrument_client(_resource.meta.client)
+    return _resource
+
+
+def get_client():
+    # A plain low-level client (DynamoDB JSON in and out). Unlike the resource,
+    # it is safe to use from several threads. Note that `get_resource().meta.client`
+    # is not a substitute: the resource installs its type conversions on it.
+    global _client
+    if _client is None:
+        _client = _get_session().client(
+            'dynamodb',
+            endpoint_url=os.environ.get('DDB_ENDPOINT_URL', None) or None,
+            config=_config()
+        )
+        metrics.instrument_client(_client)
+    return _client
+
+
+def get_aws_client(service_name):
+    """
+    A client for another AWS service (e.g. s3, lambda), with botocore's
+    default configuration rather than the DynamoDB tunables above.
+    """
+    client = _aws_clients.get(service_name, None)
+    if client is None:
+        client = _get_session().client(service_name)
+        _aws_clients[service_name] = client
+    return client
+
+
+def get_table(table_name):
+    table = _tables.get(table_name, None)
+    if table is None:
+        table = get_resource().Table(table_name)
+        _tables[table_name] = table
+    return table
+
+
+def _get_dax():
+    global _dax
+    if _dax is None:
+        _dax = AmazonDaxClient.resource(endpoint_url=DAX_ENDPOINT)
+    return _dax
+
+
+class ReadTable:
+    """
+    The read methods of a Table (get_item, query, scan), served by DAX when
+    it is available and by DynamoDB otherwise.
+
+    A call that fails on DAX is retried on DynamoDB. If DynamoDB succeeds,
+    DAX is taken to be unreachable and skipped for DAX_RETRY_SECONDS; if it
+    fails too, the request itself was at fault and its error is raised.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dax_table = None
+
+    def _call(self, method, **kwargs):
+        global _dax_down_until
+        dynamodb_table = get_table(self.table_name)
+
+        if time.monotonic() < _dax_down_until:
+            return getattr(dynamodb_table, method)(**kwargs)
+
+        started = time.perf_counter()
+        try:
+            if self.dax_table is None:
+                self.dax_table = _get_dax().Table(self.table_name)
+            response = getattr(self.dax_table, method)(**kwargs)
+        except Exception as e:
+            response = getattr(dynamodb_table, method)(**kwargs)
+            print(f"DAX {method} failed, using DynamoDB for {DAX_RETRY_SECONDS}s: {str(e)}")
+            _dax_down_until = time.monotonic() + DAX_RETRY_SECONDS
+            return response
+
+        # DAX calls do not go through botocore, so the metric hooks do not see them
+        items = response.get('Items', None)
+        metrics.recorder.add(
+            DynamoDBCalls=1,
+            DynamoDBLatency=(time.perf_counter() - started) * 1000,
+            ItemCount=len(items) if items is not None else int('Item' in response)
+        )
+        return response
+
+    def get_item(self, **kwargs):
+        return self._call('get_item', **kwargs)
+
+    def query(self, **kwargs):
+        return self._call('query', **kwargs)
+
+    def scan(self, **kwargs):
+        return self._call('scan', **kwargs)
+
+
+def get_read_table(table_name):
+    """
+    The table to read from: a DAX-backed ReadTable when DAX_ENDPOINT is set,
+    the plain DynamoDB table otherwise. Reads through DAX are eventually
+    consistent.
+    """
+    if not DAX_ENDPOINT:
+        return get_table(table_name)
+
+    table = _read_tables.get(table_name, None)
+    if table is None:
+        table = ReadTable(table_name)
+        _read_tables[table_name] = table
+    return table
+
+
+def prewarm(table_name):
+    """
+    Build the client and open a connection to DynamoDB ahead of the first
+    request. Failures are ignored; the first request will simply pay the cost.
+    """
+    try:
+        get_table(table_name).load() # DescribeTable
+    except Exception as e:
+        print(f"DynamoDB pre-warm failed: {str(e)}")
+
+
+if os.environ.get('DDB_PREWARM', 'false').lower() == 'true' and os.environ.get('TABLE_NAME', ''):
+    prewarm(os.environ['TABLE_NAME'])
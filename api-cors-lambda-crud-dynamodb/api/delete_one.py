@@ -1,10 +1,14 @@
-import json, os
-import boto3
+import os
+import db
+import encoding
+import metrics
+import cache
 
 TABLE_NAME = os.environ.get('TABLE_NAME', '')
 PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
 
 
+@metrics.instrumented
 def handler(event, context):
 
     try:
@@ -16,9 +20,9 @@ def handler(event, context):
         if req_item_id is None:
             raise ValueError("invalid request, you are missing the path parameter id")
         
-        ddb = boto3.resource('dynamodb')
-        table = ddb.Table(TABLE_NAME)
+        table = db.get_table(TABLE_NAME)
         response = table.delete_item(Key={ PRIMARY_KEY: req_item_id })
+        cache.item_cache.evict(req_item_id) # matters when get_one shares this container (router mode)
 
         status_code = 200
         resp = {"description": "Successfully deleted."}
@@ -31,5 +35,5 @@ def handler(event, context):
         status_code = 500
         resp = {"description": f"Internal server error. {str(e)}"}
 
-    return { "statusCode": status_code, "body": json.dumps(resp) }
+    return encoding.build_response(event, status_code, resp)
 
@@ -0,0 +1,155 @@
+import base64, gzip, json, os, time
+from decimal import Decimal
+
+from boto3.dynamodb.types import Binary
+
+import metrics
+
+# Request decoding and response encoding shared by all handlers.
+#
+# Responses are JSON, serialized with orjson when it is bundled with the
+# function and with the standard json module otherwise. Bodies of at least
+# COMPRESSION_MIN_BYTES are compressed with brotli (if installed) or gzip,
+# depending on the request's Accept-Encoding. Compressed bodies are sent
+# base64-encoded, which API Gateway turns back into binary because the
+# stack registers */* as a binary media type.
+
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def json_default(obj):
+    """
+    `default` hook for the JSON encoders, for the types DynamoDB hands back:
+    every number is a Decimal, sets come back as Python sets and binary
+    attributes as boto3 Binary.
+    """
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    if isinstance(obj, Binary):
+        return base64.b64encode(obj.value).decode('ascii')
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Serialize to compact UTF-8 JSON bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default)
+    return json.dumps(obj, default=json_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(body):
+    # DynamoDB does not take floats, so read numbers as Decimal
+    return json.loads(body, parse_float=Decimal)
+
+
+def read_body(event):
+    """
+    The request body as text, or None. Because of the */* binary media type,
+    API Gateway hands request bodies over base64-encoded.
+    """
+    body = event.get("body", None)
+    if body is not None and event.get("isBase64Encoded", False):
+        body = base64.b64decode(body).decode('utf-8')
+    return body
+
+
+def get_header(event, name):
+    # header names are case-insensitive, and API Gateway keeps whatever case the client sent
+    name = name.lower()
+    for (key, value) in (event.get("headers", None) or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick a content coding from an Accept-Encoding header: "br", "gzip" or
+    None for no compression.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for part in accept_encoding.split(','):
+        fields = part.strip().split(';')
+        coding = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    wildcard = qualities.get('*', 0.0)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    for coding in candidates:
+        if qualities.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def compress(data, coding):
+    if coding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def build_response(event, status_code, resp, headers=None, compressible=True):
+    """
+    The Lambda proxy integration response for `resp`. A `resp` of None sends
+    no body (e.g. for 304 Not Modified). With `compressible=False` the body
+    is never compressed.
+    """
+    started = time.perf_counter()
+    try:
+        return _build_response(event, status_code, resp, headers, compressible)
+    finally:
+        metrics.recorder.add(SerializeLatency=(time.perf_counter() - started) * 1000)
+
+
+def _build_response(event, status_code, resp, headers, compressible):
+    headers = dict(headers or {})
+
+    if resp is None:
+        return { "statusCode": status_code, "headers": headers, "body": "" }
+
+    data = dumps(resp)
+    headers["Content-Type"] = "application/json"
+    headers["Vary"] = "Accept-Encoding"
+
+    coding = None
+    if compressible and len(data) >= COMPRESSION_MIN_BYTES:
+        coding = choose_encoding(get_header(event, 'Accept-Encoding'))
+
+    if coding is None:
+        return { "statusCode": status_code, "headers": headers, "body": data.decode('utf-8') }
+
+    headers["Content-Encoding"] = coding
+    return {
+        "statusCode": status_code,
+        "headers": headers,
+        "body": base64.b64encode(compress(data, coding)).decode('ascii'),
+        "isBase64Encoded": True
+    }
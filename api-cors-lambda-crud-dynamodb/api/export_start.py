@@ -0,0 +1,68 @@
+import json, os
+import db
+import encoding
+import metrics
+import jobs
+
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET', '')
+EXPORT_WORKER_FUNCTION = os.environ.get('EXPORT_WORKER_FUNCTION', '')
+DEFAULT_EXPORT_SEGMENTS = int(os.environ.get('DEFAULT_EXPORT_SEGMENTS', '4'))
+MAX_EXPORT_SEGMENTS = int(os.environ.get('MAX_EXPORT_SEGMENTS', '64'))
+
+def start_export(segments):
+    """
+    Create the job record and start one export_worker per scan segment.
+    """
+    job = jobs.create_job(
+        'export',
+        bucket=EXPORT_BUCKET,
+        totalSegments=segments,
+        segmentsDone=0,
+        itemsExported=0,
+        files=[]
+    )
+
+    lambda_client = db.get_aws_client('lambda')
+    try:
+        for segment in range(segments):
+            lambda_client.invoke(
+                FunctionName=EXPORT_WORKER_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({"jobId": job["jobId"], "segment": segment, "totalSegments": segments})
+            )
+    except Exception as e:
+        jobs.finish_job(job["jobId"], jobs.FAILED, f"could not start the export workers: {str(e)}")
+        raise
+
+    return job
+
+@metrics.instrumented
+def handler(event, context):
+
+    headers = {}
+
+    try:
+        body = encoding.read_body(event)
+        request = encoding.loads(body) if body else {}
+        if not isinstance(request, dict):
+            raise ValueError("invalid request, body must be a JSON object")
+
+        segments = request.get("segments", DEFAULT_EXPORT_SEGMENTS)
+        if not isinstance(segments, int) or isinstance(segments, bool) or not 1 <= segments <= MAX_EXPORT_SEGMENTS:
+            raise ValueError(f"invalid request, segments must be an integer between 1 and {MAX_EXPORT_SEGMENTS}")
+
+        job = start_export(segments)
+
+        headers["Location"] = f"/items/export/{job['jobId']}"
+        status_code = 202
+        resp = {"jobId": job["jobId"], "status": job["status"]}
+
+    except ValueError as e:
+        status_code = 400
+        resp = {"description": f"Bad request. {str(e)}"}
+
+    except Exception as e:
+        status_code = 500
+        resp = {"description": f"Internal server error. {str(e)}"}
+
+    return encoding.build_response(event, status_code, resp, headers)
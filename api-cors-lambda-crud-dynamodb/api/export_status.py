@@ -0,0 +1,46 @@
+import os
+import db
+import encoding
+import metrics
+import jobs
+
+EXPORT_URL_EXPIRY_SECONDS = int(os.environ.get('EXPORT_URL_EXPIRY_SECONDS', '3600'))
+
+@metrics.instrumented
+def handler(event, context):
+
+    try:
+        path_parameters = event.get("pathParameters", None) or {}
+        job_id = path_parameters.get("jobId", None)
+        if job_id is None:
+            raise ValueError("invalid request, you are missing the path parameter jobId")
+
+        job = jobs.get_job(job_id)
+        if job is None or job.get("type", None) != 'export':
+            status_code = 404
+            resp = {"description": "Not found."}
+
+        else:
+            resp = job
+            if job["status"] == jobs.SUCCEEDED:
+                # time-limited links to the NDJSON files, so that callers need no S3 permissions
+                s3 = db.get_aws_client('s3')
+                resp = dict(job, urls=[
+                    s3.generate_presigned_url(
+                        'get_object',
+                        Params={"Bucket": job["bucket"], "Key": key},
+                        ExpiresIn=EXPORT_URL_EXPIRY_SECONDS
+                    )
+                    for key in job.get("files", [])
+                ])
+            status_code = 200
+
+    except ValueError as e:
+        status_code = 400
+        resp = {"description": f"Bad request. {str(e)}"}
+
+    except Exception as e:
+        status_code = 500
+        resp = {"description": f"Internal server error. {str(e)}"}
+
+    return encoding.build_response(event, status_code, resp)
@@ -0,0 +1,76 @@
+import json, os
+import db
+import encoding
+import pagination
+import jobs
+from s3_streams import GzipMultipartUpload
+
+# Background worker of POST /items/export, invoked asynchronously once per
+# scan segment by export_start.py.
+#
+# The worker scans its segment page by page and streams the items, as
+# gzipped NDJSON, into an S3 multipart upload. When the invocation runs out
+# of time, it closes the current file and invokes itself to carry on from
+# the last page, writing the next file of the segment.
+#
+# Files are named exports/<jobId>/segment-<segment>-<chunk>.ndjson.gz.
+
+TABLE_NAME = os.environ.get('TABLE_NAME', '')
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET', '')
+EXPORT_CONTINUE_BEFORE_MS = int(os.environ.get('EXPORT_CONTINUE_BEFORE_MS', '60000'))
+
+
+def export_key(job_id, segment, chunk):
+    return f"exports/{job_id}/segment-{segment:04d}-{chunk:04d}.ndjson.gz"
+
+
+def handler(event, context):
+    job_id = event["jobId"]
+    segment = event["segment"]
+    total_segments = event["totalSegments"]
+    chunk = event.get("chunk", 0)
+
+    key = export_key(job_id, segment, chunk)
+    upload = None
+    try:
+        upload = GzipMultipartUpload(db.get_aws_client('s3'), EXPORT_BUCKET, key)
+
+        scan_kwargs = {}
+        if event.get("startKey", None):
+            scan_kwargs["ExclusiveStartKey"] = event["startKey"]
+
+        last_evaluated_key = None
+        pages = pagination.scan_segment_pages(db.get_client(), TABLE_NAME, segment, total_segments, **scan_kwargs)
+        for (items, last_evaluated_key) in pages:
+            for item in items:
+                upload.write(encoding.dumps(item) + b"\n")
+            jobs.record_progress(job_id, itemsExported=len(items))
+
+            if last_evaluated_key and context.get_remaining_time_in_millis() < EXPORT_CONTINUE_BEFORE_MS:
+                break
+
+        upload.close()
+
+        if last_evaluated_key:
+            # out of time: the next invocation writes the next file of this segment
+            jobs.record_progress(job_id, lists={"files": [key]})
+            db.get_aws_client('lambda').invoke(
+                FunctionName=context.function_name,
+                InvocationType='Event',
+                Payload=json.dumps(dict(event, chunk=chunk + 1, startKey=last_evaluated_key))
+            )
+            return
+
+        job = jobs.record_progress(job_id, lists={"files": [key]}, segmentsDone=1)
+        if job["segmentsDone"] >= job["totalSegments"]:
+            jobs.finish_job(job_id, jobs.SUCCEEDED)
+
+    except Exception as e:
+        # not raised: Lambda would retry the invocation, and export the segment twice
+        print(f"Export {job_id} failed in segment {segment}: {str(e)}")
+        if upload is not None:
+            try:
+                upload.abort()
+            except Exception:
+                pass
+        jobs.finish_job(job_id, jobs.FAILED, f"segment {segment}: {str(e)}")
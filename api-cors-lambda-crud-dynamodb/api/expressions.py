@@ -0,0 +1,68 @@
+import re
+
+# Helpers to build DynamoDB expressions from client-supplied attribute paths.
+#
+# Attribute names never go into an expression verbatim: every name is
+# replaced by an ExpressionAttributeNames placeholder, so reserved words
+# (e.g. "name", "status") and names with special characters just work.
+
+_SEGMENT = re.compile(r'^([^.\[\]]+)((?:\[\d+\])*)$')
+
+
+def parse_path(path):
+    """
+    Split a document path such as "a.b[0].c" into [(name, "[0]-suffix")].
+    Raises ValueError if it is not a valid path.
+    """
+    if not isinstance(path, str) or not path:
+        raise ValueError("invalid request, attribute paths must be non-empty strings")
+
+    segments = []
+    for segment in path.split('.'):
+        match = _SEGMENT.match(segment)
+        if match is None:
+            raise ValueError(f"invalid request, malformed attribute path '{path}'")
+        segments.append((match.group(1), match.group(2)))
+    return segments
+
+
+class ExpressionBuilder:
+    """
+    Collects ExpressionAttributeNames / ExpressionAttributeValues while
+    expressions are being put together.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.values = {}
+        self._placeholders = {}
+
+    def name(self, name):
+        placeholder = self._placeholders.get(name, None)
+        if placeholder is None:
+            placeholder = f"#n{len(self._placeholders)}"
+            self._placeholders[name] = placeholder
+            self.names[placeholder] = name
+        return placeholder
+
+    def path(self, path):
+        return ".".join(
+            self.name(name) + indexes for (name, indexes) in parse_path(path)
+        )
+
+    def value(self, value):
+        placeholder = f":v{len(self.values)}"
+        self.values[placeholder] = value
+        return placeholder
+
+    def params(self):
+        """
+        The ExpressionAttributeNames / ExpressionAttributeValues kwargs
+        collected so far (empty ones are left out, as DynamoDB requires).
+        """
+        params = {}
+        if self.names:
+            params["ExpressionAttributeNames"] = self.names
+        if self.values:
+            params["ExpressionAttributeValues"] = self.values
+        return params
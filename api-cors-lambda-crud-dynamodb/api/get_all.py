@@ -1,21 +1,91 @@
-import json, os
-import boto3
+import os
+import db
+import encoding
+import metrics
+import pagination
+import projection
+import query
+import response_cache
+from expressions import ExpressionBuilder
+from batch_get import get_items
 
 TABLE_NAME = os.environ.get('TABLE_NAME', '')
 PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
+PARALLEL_SCAN_ENABLED = os.environ.get('PARALLEL_SCAN_ENABLED', 'false').lower() == 'true'
 
+def projection_kwargs(params):
+    """
+    ProjectionExpression / ExpressionAttributeNames for ?fields=..., if any.
+    """
+    fields = projection.parse_fields(params)
+    if not fields:
+        return {}
+
+    builder = ExpressionBuilder()
+    kwargs = projection.projection_params(builder, fields)
+    kwargs.update(builder.params())
+    return kwargs
+
+@metrics.instrumented
 def handler(event, context):
 
     try:
-        ddb = boto3.resource('dynamodb')
-        table = ddb.Table(TABLE_NAME)
-        response = table.scan()
+        params = event.get("queryStringParameters", None) or {}
+
+        if params.get("ids", None) is not None:
+            # multi-get: GET /items?ids=a,b,c
+            if any(name in params for name in ("cursor", "limit", "segments", "index")):
+                raise ValueError("invalid request, ids cannot be combined with limit, cursor, segments or index")
+
+            ids = [ item_id.strip() for item_id in params["ids"].split(",") ]
+            resp = {"results": get_items(ids, projection.parse_fields(params))}
+
+        elif params.get("index", None) is not None:
+            # GET /items?index=<name>&key=<value>: query a secondary index
+            if "segments" in params:
+                raise ValueError("invalid request, index cannot be combined with segments")
+
+            table = db.get_read_table(TABLE_NAME)
+            items, next_cursor = query.query_page(table, params)
+            resp = {"items": items, "cursor": next_cursor}
+
+        elif params.get("segments", None) is not None:
+            # bulk mode: every page reads the `segments` parts of the table side by
+            # side, with `limit` shared out between them and one cursor for all
+            if not PARALLEL_SCAN_ENABLED:
+                raise ValueError("invalid request, parallel scan is not enabled")
+
+            total_segments = pagination.parse_int_param(
+                params, "segments", 1, 1, pagination.MAX_SCAN_SEGMENTS
+            )
+            limit = pagination.parse_int_param(
+                params, "limit", pagination.DEFAULT_PAGE_SIZE, 1, pagination.MAX_PAGE_SIZE
+            )
+            items, next_cursor = pagination.parallel_scan_page(
+                db.get_client(), TABLE_NAME, total_segments, limit,
+                params.get("cursor", None), **projection_kwargs(params)
+            )
+            resp = {"items": items, "cursor": next_cursor}
+
+        else:
+            scan_kwargs = pagination.parse_page_params(params)
+            scan_kwargs.update(projection_kwargs(params))
+
+            table = db.get_read_table(TABLE_NAME)
+            items, next_cursor = pagination.scan_page(table, **scan_kwargs)
+            resp = {"items": items, "cursor": next_cursor}
 
         status_code = 200
-        resp = response['Items']
-    
+
+    except ValueError as e:
+        status_code = 400
+        resp = {"description": f"Bad request. {str(e)}"}
+
     except Exception as e:
         status_code = 500
         resp = {"description": f"Internal server error. {str(e)}"}
 
-    return { "statusCode": status_code, "body": json.dumps(resp) }
+    # a stage cache entry is served to every client, whatever its Accept-Encoding
+    return encoding.build_response(
+        event, status_code, resp, compressible=not response_cache.RESPONSE_CACHE_ENABLED
+    )
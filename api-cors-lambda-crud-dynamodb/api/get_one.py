@@ -1,11 +1,75 @@
 import json, os
-import boto3
+import db
+import encoding
+import metrics
+import cache
+import projection
+import response_cache
+from expressions import ExpressionBuilder
 
 TABLE_NAME = os.environ.get('TABLE_NAME', '')
 PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
 
+def read_item(table, item_id, fields=None, bypass=False):
+    """
+    Read-through lookup in the container cache. Returns (item, cache_status);
+    item is None if it does not exist. With `bypass`, the item is read with
+    a strongly consistent read whether it is cached or not.
+
+    With `fields`, a cache miss only reads those attributes (and the
+    version), and the partial item is not cached. Cached items are returned
+    whole either way; the caller projects them.
+    """
+    item_cache = cache.item_cache
+    item, fresh = item_cache.get(item_id) if not bypass else (None, False)
+
+    if item is not None and fresh:
+        item_cache.hits += 1
+        return item, "HIT"
+
+    if item is not None:
+        # stale entry: only fetch the version to find out if it is still good
+        item_cache.revalidations += 1
+        response = table.get_item(
+            Key={ PRIMARY_KEY: item_id },
+            ProjectionExpression="#version",
+            ExpressionAttributeNames={ "#version": cache.VERSION_ATTRIBUTE }
+        )
+        current = response.get('Item', None)
+        if current is None:
+            item_cache.evict(item_id)
+            return None, "REVALIDATED"
+
+        version = item.get(cache.VERSION_ATTRIBUTE, None)
+        if version is not None and current.get(cache.VERSION_ATTRIBUTE, None) == version:
+            item_cache.put(item_id, item)
+            return item, "REVALIDATED"
+
+    item_cache.misses += 1
+    consistency = { 'ConsistentRead': True } if bypass else {}
+    if fields:
+        builder = ExpressionBuilder()
+        response = table.get_item(
+            Key={ PRIMARY_KEY: item_id },
+            **projection.projection_params(builder, fields, required=[cache.VERSION_ATTRIBUTE]),
+            **builder.params(),
+            **consistency
+        )
+        return response.get('Item', None), "MISS"
+
+    response = table.get_item(Key={ PRIMARY_KEY: item_id }, **consistency)
+    item = response.get('Item', None)
+    if item is None:
+        item_cache.evict(item_id)
+    else:
+        item_cache.put(item_id, item)
+    return item, "MISS"
+
+@metrics.instrumented
 def handler(event, context):
 
+    headers = {}
+
     try:
         path_parameters = event.get("pathParameters", None)
         if path_parameters is None:
@@ -15,12 +79,36 @@ def handler(event, context):
         if req_item_id is None:
             raise ValueError("Error: You are missing the path parameter id")
         
-        ddb = boto3.resource('dynamodb')
-        table = ddb.Table(TABLE_NAME)
-        response = table.get_item(Key={ PRIMARY_KEY: req_item_id })
+        fields = projection.parse_fields(event.get("queryStringParameters", None) or {})
+
+        # stage cache invalidations must not get the item from a cache (or DAX) either
+        bypass = response_cache.bypass_requested(event)
+        table = db.get_table(TABLE_NAME) if bypass else db.get_read_table(TABLE_NAME)
+        item, cache_status = read_item(table, req_item_id, fields, bypass)
+
+        stats = cache.item_cache.stats()
+        headers["X-Cache"] = cache_status
+        headers["X-Cache-Stats"] = ";".join(f"{k}={v}" for (k, v) in stats.items())
+        print(json.dumps({"cache": cache_status, **stats}))
 
-        status_code = 200
-        resp = response['Item']
+        if item is None:
+            status_code = 404
+            resp = {"description": "Not found."}
+
+        else:
+            etag = cache.make_etag(req_item_id, item, fields)
+            headers["ETag"] = etag
+            if fields:
+                item = projection.project_item(item, fields)
+
+            # a 304 must not end up in the stage cache, where other clients would get it
+            if not response_cache.RESPONSE_CACHE_ENABLED and \
+                    cache.etag_matches(encoding.get_header(event, 'If-None-Match'), etag):
+                status_code = 304 # the client already has this version, send no body
+                resp = None
+            else:
+                status_code = 200
+                resp = item
     
     except ValueError as e:
         status_code = 400
@@ -30,5 +118,6 @@ def handler(event, context):
         status_code = 500
         resp = {"description": f"Internal server error. {str(e)}"}
 
-    return { "statusCode": status_code, "body": json.dumps(resp) }
-
+    return encoding.build_response(
+        event, status_code, resp, headers, compressible=not response_cache.RESPONSE_CACHE_ENABLED
+    )
@@ -0,0 +1,16 @@
+import encoding
+import metrics
+import stats
+
+@metrics.instrumented
+def handler(event, context):
+
+    try:
+        status_code = 200
+        resp = stats.read_stats()
+
+    except Exception as e:
+        status_code = 500
+        resp = {"description": f"Internal server error. {str(e)}"}
+
+    return encoding.build_response(event, status_code, resp)
@@ -0,0 +1,197 @@
+import json, os, time, urllib.parse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import db
+import encoding
+import batching
+import cache
+from create import new_item
+from s3_streams import GzipMultipartUpload, iter_lines
+
+# Bulk import of NDJSON files (one item per line, optionally gzipped) that
+# land under incoming/ in the import bucket.
+#
+# The file is read as a stream, and the items are written with
+# BatchWriteItem, IMPORT_BATCH_ITEMS rows per batch and at most
+# IMPORT_CONCURRENCY batches at a time (batching.py retries throttled
+# writes with backoff). Rows without an itemID get a new one, as with
+# POST /items; rows with one keep it, so that migrations keep their keys.
+#
+# A row with an itemID may replace an item that is cached (see cache.py):
+# it gets a version no earlier write of that item can have had, the time
+# of the import in microseconds, so that the caches and ETags let go of the
+# old content. UpdateItem adds 1 to it from there.
+#
+# Rows that cannot be imported are listed, with the reason, in
+# reports/<name>.rejected.ndjson.gz, and every import writes a summary to
+# reports/<name>.summary.json.
+
+TABLE_NAME = os.environ.get('TABLE_NAME', '')
+PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
+IMPORT_BATCH_ITEMS = int(os.environ.get('IMPORT_BATCH_ITEMS', '500'))
+IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', '4'))
+MAX_REPORTED_ROW_CHARS = 10000
+# stop reading with this much of the invocation left, to write the reports in time
+IMPORT_STOP_BEFORE_MS = int(os.environ.get('IMPORT_STOP_BEFORE_MS', '60000'))
+
+INCOMING_PREFIX = 'incoming/'
+REPORT_PREFIX = 'reports/'
+
+
+_last_version = 0
+
+
+def import_version():
+    """
+    A version above any that an existing item can have: the current time in
+    microseconds, and strictly increasing, so that rows of one file with the
+    same itemID get versions of their own too.
+    """
+    global _last_version
+    _last_version = max(_last_version + 1, time.time_ns() // 1000)
+    return _last_version
+
+
+def to_item(line):
+    """
+    Parse one NDJSON row into an item. Raises ValueError if it cannot be imported.
+    """
+    row = encoding.loads(line)
+    if not isinstance(row, dict):
+        raise ValueError("row must be a JSON object")
+
+    if row.get(PRIMARY_KEY, None) in (None, ''):
+        item = new_item(row)
+    elif not isinstance(row[PRIMARY_KEY], str):
+        raise ValueError(f"{PRIMARY_KEY} must be a string")
+    else:
+        row[cache.VERSION_ATTRIBUTE] = import_version()
+        item = row
+    batching.check_item(item)
+    return item
+
+
+class Import:
+    """
+    The import of one S3 object.
+    """
+
+    def __init__(self, s3, bucket, key, context):
+        self.s3 = s3
+        self.context = context
+        self.bucket = bucket
+        self.key = key
+        name = key[len(INCOMING_PREFIX):] if key.startswith(INCOMING_PREFIX) else key
+        self.report_key = f"{REPORT_PREFIX}{name}.rejected.ndjson.gz"
+        self.summary_key = f"{REPORT_PREFIX}{name}.summary.json"
+        self.report = None
+        self.rows = 0
+        self.written = 0
+        self.rejected = 0
+        self.next_line = None # where an import that ran out of time stopped
+
+    def reject(self, line_number, reason, row):
+        # the report is only created once there is something to report
+        if self.report is None:
+            self.report = GzipMultipartUpload(self.s3, self.bucket, self.report_key)
+        if isinstance(row, bytes):
+            row = row.decode('utf-8', 'replace')
+        elif not isinstance(row, str):
+            row = encoding.dumps(row).decode('utf-8')
+        self.report.write(encoding.dumps({
+            "line": line_number,
+            "reason": reason,
+            "row": row[:MAX_REPORTED_ROW_CHARS]
+        }) + b"\n")
+        self.rejected += 1
+
+    @staticmethod
+    def write_batch(batch):
+        """
+        Write one batch ({key: (line_number, item)}), from a worker thread.
+        Returns the rows that could not be written, as (line_number, error, item).
+        """
+        errors = batching.batch_write_items(
+            db.get_client(), TABLE_NAME, [ item for (_, item) in batch.values() ], PRIMARY_KEY
+        )
+        return [
+            (line_number, errors[key], item)
+            for (key, (line_number, item)) in batch.items() if errors[key] is not None
+        ], len(batch)
+
+    def collect(self, futures):
+        for future in futures:
+            (failed, size) = future.result()
+            self.written += size - len(failed)
+            for (line_number, error, item) in failed:
+                self.reject(line_number, error, item)
+
+    def run(self):
+        body = self.s3.get_object(Bucket=self.bucket, Key=self.key)['Body']
+        lines = iter_lines(body, gzipped=self.key.endswith('.gz'))
+
+        batch = {}
+        pending = set()
+        with ThreadPoolExecutor(max_workers=IMPORT_CONCURRENCY) as executor:
+            for (line_number, line) in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                self.rows += 1
+
+                try:
+                    item = to_item(line)
+                except ValueError as e:
+                    self.reject(line_number, str(e), line)
+                    continue
+
+                # BatchWriteItem rejects repeated keys: within a batch, the last row wins
+                batch[item[PRIMARY_KEY]] = (line_number, item)
+                if len(batch) >= IMPORT_BATCH_ITEMS:
+                    if len(pending) >= IMPORT_CONCURRENCY:
+                        (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+                        self.collect(done)
+                    pending.add(executor.submit(self.write_batch, batch))
+                    batch = {}
+
+                    if self.context.get_remaining_time_in_millis() < IMPORT_STOP_BEFORE_MS:
+                        self.next_line = line_number + 1
+                        break
+
+            if batch:
+                pending.add(executor.submit(self.write_batch, batch))
+            self.collect(wait(pending)[0])
+
+        if self.report is not None:
+            self.report.close()
+
+        summary = {
+            "source": f"s3://{self.bucket}/{self.key}",
+            "rows": self.rows,
+            "written": self.written,
+            "rejected": self.rejected,
+            # the rows from nextLine on were not read: import them from another file
+            "complete": self.next_line is None,
+            "nextLine": self.next_line,
+            "report": f"s3://{self.bucket}/{self.report_key}" if self.report is not None else None
+        }
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self.summary_key,
+            Body=encoding.dumps(summary), ContentType='application/json'
+        )
+        return summary
+
+
+def handler(event, context):
+    s3 = db.get_aws_client('s3')
+
+    # one notification may carry several objects
+    for record in event.get("Records", []):
+        bucket = record["s3"]["bucket"]["name"]
+        key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+
+        try:
+            print(json.dumps(Import(s3, bucket, key, context).run()))
+        except Exception as e:
+            # not raised, and the stack turns off the retries of the asynchronous
+            # invocation: a retry would import the rows without an itemID twice
+            print(f"Import of s3://{bucket}/{key} failed: {str(e)}")
@@ -0,0 +1,93 @@
+import os, time, uuid
+from botocore.exceptions import ClientError
+
+import db
+from expressions import ExpressionBuilder
+
+# Records of background jobs (exports, imports) in the jobs table.
+#
+# A job is created RUNNING by the API and advanced by its workers. Workers
+# run in parallel, so progress is only ever added (ADD / list_append), and
+# the final status is only set while the job is still RUNNING: a job that
+# failed in one worker stays FAILED whatever the others do afterwards.
+# Records expire after JOB_RETENTION_SECONDS (the table's TTL attribute).
+
+JOBS_TABLE_NAME = os.environ.get('JOBS_TABLE_NAME', '')
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
+RUNNING = 'RUNNING'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+
+
+def create_job(job_type, **attributes):
+    now = int(time.time())
+    job = {
+        "jobId": uuid.uuid4().hex,
+        "type": job_type,
+        "status": RUNNING,
+        "createdAt": now,
+        "updatedAt": now,
+        "expiresAt": now + JOB_RETENTION_SECONDS,
+        **attributes
+    }
+    db.get_table(JOBS_TABLE_NAME).put_item(Item=job)
+    return job
+
+
+def get_job(job_id):
+    return db.get_table(JOBS_TABLE_NAME).get_item(Key={ "jobId": job_id }).get('Item', None)
+
+
+def record_progress(job_id, lists=None, **counters):
+    """
+    Add `counters` to the job's number attributes and append `lists` to its
+    list attributes. Returns the job as updated.
+    """
+    builder = ExpressionBuilder()
+    adds = [ f"{builder.name(name)} {builder.value(value)}" for (name, value) in counters.items() ]
+    sets = [ f"{builder.name('updatedAt')} = {builder.value(int(time.time()))}" ]
+    for (name, values) in (lists or {}).items():
+        sets.append(
+            f"{builder.name(name)} = list_append(if_not_exists({builder.name(name)}, {builder.value([])}), "
+            f"{builder.value(values)})"
+        )
+
+    expression = "SET " + ", ".join(sets)
+    if adds:
+        expression += " ADD " + ", ".join(adds)
+
+    response = db.get_table(JOBS_TABLE_NAME).update_item(
+        Key={ "jobId": job_id },
+        UpdateExpression=expression,
+        ReturnValues='ALL_NEW',
+        **builder.params()
+    )
+    return response['Attributes']
+
+
+def finish_job(job_id, status, error=None):
+    """
+    Set the final status of a job, unless it already has one. Returns True
+    if this call set it.
+    """
+    builder = ExpressionBuilder()
+    sets = [
+        f"{builder.name('status')} = {builder.value(status)}",
+        f"{builder.name('updatedAt')} = {builder.value(int(time.time()))}"
+    ]
+    if error is not None:
+        sets.append(f"{builder.name('error')} = {builder.value(error)}")
+
+    try:
+        db.get_table(JOBS_TABLE_NAME).update_item(
+            Key={ "jobId": job_id },
+            UpdateExpression="SET " + ", ".join(sets),
+            ConditionExpression=f"{builder.name('status')} = {builder.value(RUNNING)}",
+            **builder.params()
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
@@ -0,0 +1,167 @@
+import functools, json, os, threading, time
+
+# Per-invocation metrics, logged as one CloudWatch Embedded Metric Format
+# (EMF) line per request. CloudWatch turns the line into metrics in
+# METRICS_NAMESPACE, with the route as the only dimension.
+#
+# db.py hooks every DynamoDB client into this module: each call is made with
+# ReturnConsumedCapacity=TOTAL (where the operation supports it), and its
+# latency, capacity units, item count and throttled attempts are added to
+# the current invocation. encoding.build_response times the serialization.
+# The rest of the handler's time (request parsing and handler logic) is
+# reported as ParseLatency.
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ItemsService')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+READ_OPERATIONS = ('GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems')
+THROTTLING_ERRORS = (
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'
+)
+
+UNITS = {
+    "Latency": "Milliseconds",
+    "ParseLatency": "Milliseconds",
+    "DynamoDBLatency": "Milliseconds",
+    "SerializeLatency": "Milliseconds",
+    "DynamoDBCalls": "Count",
+    "ReadCapacityUnits": "Count",
+    "WriteCapacityUnits": "Count",
+    "ItemCount": "Count",
+    "Throttles": "Count"
+}
+
+
+class Recorder:
+    """
+    Adds up the figures of one invocation. DynamoDB calls may come from
+    several threads (parallel scan, batch requests), hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.values = { name: 0.0 for name in UNITS }
+
+    def add(self, **values):
+        with self.lock:
+            for (name, value) in values.items():
+                self.values[name] += value
+
+
+recorder = Recorder()
+
+
+def _request_capacity(params, model, context=None, **kwargs):
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    if model.name == 'BatchWriteItem' and context is not None:
+        # the response only lists the requests that were *not* processed
+        context['metrics_write_requests'] = sum(
+            len(requests) for requests in params.get('RequestItems', {}).values()
+        )
+
+
+def _start_call(context, **kwargs):
+    context['metrics_started'] = time.perf_counter()
+
+
+def _item_count(operation, parsed, context):
+    if 'Items' in parsed:
+        return len(parsed['Items'])
+    if 'Responses' in parsed:
+        return sum(len(items) for items in parsed['Responses'].values())
+    if operation == 'BatchWriteItem':
+        unprocessed = sum(len(requests) for requests in parsed.get('UnprocessedItems', {}).values())
+        return context.get('metrics_write_requests', 0) - unprocessed
+    if operation == 'GetItem':
+        return 1 if 'Item' in parsed else 0
+    if operation in ('PutItem', 'UpdateItem', 'DeleteItem'):
+        return 1
+    return 0
+
+
+def _end_call(parsed, model, context, **kwargs):
+    started = context.get('metrics_started', None)
+    latency = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    consumed = parsed.get('ConsumedCapacity', None) or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    units = sum(entry.get('CapacityUnits', 0.0) for entry in consumed)
+    read = model.name in READ_OPERATIONS
+
+    failed = 'Error' in parsed
+    recorder.add(
+        DynamoDBCalls=1,
+        DynamoDBLatency=latency,
+        ReadCapacityUnits=units if read else 0.0,
+        WriteCapacityUnits=0.0 if read else units,
+        ItemCount=0 if failed else _item_count(model.name, parsed, context)
+    )
+
+
+def _count_throttle(response=None, **kwargs):
+    # fired once per attempt, before botocore decides whether to retry
+    if response is not None:
+        code = response[1].get('Error', {}).get('Code', None)
+        if code in THROTTLING_ERRORS:
+            recorder.add(Throttles=1)
+
+
+def instrument_client(client):
+    """
+    Register the metric hooks on a DynamoDB client (or a resource's client).
+    """
+    if not METRICS_ENABLED:
+        return
+    events = client.meta.events
+    events.register('provide-client-params.dynamodb.*', _request_capacity)
+    events.register('before-call.dynamodb.*', _start_call)
+    events.register('after-call.dynamodb.*', _end_call)
+    events.register_first('needs-retry.dynamodb.*', _count_throttle)
+
+
+def emit(route, status_code, latency):
+    values = dict(recorder.values)
+    values["Latency"] = latency
+    values["ParseLatency"] = max(0.0, latency - values["DynamoDBLatency"] - values["SerializeLatency"])
+
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Route"]],
+                "Metrics": [ {"Name": name, "Unit": unit} for (name, unit) in UNITS.items() ]
+            }]
+        },
+        "Route": route,
+        "StatusCode": status_code,
+        **values
+    }))
+
+
+def instrumented(handler):
+    """
+    Decorator for the Lambda handlers: one EMF line per invocation, with the
+    route taken from the API Gateway event.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not METRICS_ENABLED:
+            return handler(event, context)
+
+        recorder.reset()
+        started = time.perf_counter()
+        response = handler(event, context)
+        latency = (time.perf_counter() - started) * 1000
+
+        route = f"{event.get('httpMethod', None)} {event.get('resource', None)}"
+        emit(route, response.get('statusCode', None), latency)
+        return response
+
+    return wrapper
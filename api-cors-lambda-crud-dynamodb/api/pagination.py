@@ -0,0 +1,176 @@
+import base64, json, os
+
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '100'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '1000'))
+MAX_SCAN_SEGMENTS = int(os.environ.get('MAX_SCAN_SEGMENTS', '16'))
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def encode_cursor(last_evaluated_key):
+    """
+    Turn a LastEvaluatedKey into an opaque, url-safe cursor string.
+    Returns None when there is no next page.
+    """
+    if not last_evaluated_key:
+        return None
+
+    # use the DynamoDB JSON form, so that number keys survive the round trip
+    key = { k: _serializer.serialize(v) for (k, v) in last_evaluated_key.items() }
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor(). Raises ValueError on a malformed cursor.
+    """
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        key = json.loads(raw)
+        return { k: _deserializer.deserialize(v) for (k, v) in key.items() }
+    except Exception:
+        raise ValueError("invalid request, malformed cursor")
+
+
+def parse_int_param(params, name, default, minimum, maximum):
+    """
+    Read an integer query string parameter and check its range. Only plain
+    digits (or an int, but not a bool, which is an int in Python) are taken:
+    int() alone would also accept e.g. True, 2.5 or " +5".
+    """
+    value = params.get(name, None)
+    if value is None or value == '':
+        return default
+
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    elif not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError(f"invalid request, {name} must be an integer")
+
+    if value < minimum or value > maximum:
+        raise ValueError(f"invalid request, {name} must be between {minimum} and {maximum}")
+
+    return value
+
+
+def parse_page_params(params):
+    """
+    Returns the Limit / ExclusiveStartKey kwargs for a paginated scan or query.
+    """
+    kwargs = {
+        "Limit": parse_int_param(params, 'limit', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    }
+
+    start_key = decode_cursor(params.get('cursor', None))
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    return kwargs
+
+
+def scan_page(table, **kwargs):
+    """
+    Scan a single page. Returns (items, next_cursor).
+    """
+    response = table.scan(**kwargs)
+    return response['Items'], encode_cursor(response.get('LastEvaluatedKey', None))
+
+
+def scan_segment_pages(client, table_name, segment, total_segments, **kwargs):
+    """
+    Yield the pages of one segment of a parallel scan as (items, last_evaluated_key),
+    following LastEvaluatedKey until the segment is exhausted. Pass
+    ExclusiveStartKey (DynamoDB JSON) to resume a segment. Uses the low-level
+    client, which (unlike the resource API) is safe to share between threads.
+    """
+    params = dict(kwargs, TableName=table_name, Segment=segment, TotalSegments=total_segments)
+
+    while True:
+        response = client.scan(**params)
+        items = [
+            { k: _deserializer.deserialize(v) for (k, v) in item.items() }
+            for item in response['Items']
+        ]
+
+        last_evaluated_key = response.get('LastEvaluatedKey', None)
+        yield items, last_evaluated_key
+        if not last_evaluated_key:
+            return
+        params['ExclusiveStartKey'] = last_evaluated_key
+
+
+def encode_segments_cursor(total_segments, keys):
+    """
+    The cursor of a parallel scan: the LastEvaluatedKey (DynamoDB JSON, or
+    None for a segment not started yet) of each segment that is not done.
+    Returns None when every segment is done.
+    """
+    if not keys:
+        return None
+
+    raw = json.dumps(
+        { "segments": total_segments, "keys": { str(s): key for (s, key) in keys.items() } },
+        separators=(',', ':')
+    ).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_segments_cursor(cursor, total_segments):
+    """
+    Inverse of encode_segments_cursor(): {segment: key or None}. Without a
+    cursor, every segment is still to be read. Raises ValueError on a
+    malformed cursor, or one from a scan with another number of segments.
+    """
+    if not cursor:
+        return { segment: None for segment in range(total_segments) }
+
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        keys = { int(s): key for (s, key) in state["keys"].items() }
+        segments = state["segments"]
+    except Exception:
+        raise ValueError("invalid request, malformed cursor")
+    if not keys:
+        raise ValueError("invalid request, malformed cursor")
+
+    if segments != total_segments or not all(0 <= s < total_segments for s in keys):
+        raise ValueError("invalid request, cursor is from a scan with another number of segments")
+    return keys
+
+
+def parallel_scan_page(client, table_name, total_segments, limit, cursor, **kwargs):
+    """
+    Read one page of a parallel scan: one Scan page from each segment not
+    done yet, side by side, with `limit` shared out between them. Meant for
+    internal bulk readers. Returns (items, next_cursor), where the cursor
+    holds where each segment stopped.
+    """
+    from concurrent.futures import ThreadPoolExecutor # only the bulk mode needs threads
+
+    keys = decode_segments_cursor(cursor, total_segments)
+    segment_limit = max(1, limit // len(keys))
+
+    def read(segment):
+        params = dict(kwargs, Limit=segment_limit)
+        if keys[segment] is not None:
+            params["ExclusiveStartKey"] = keys[segment]
+        return next(scan_segment_pages(client, table_name, segment, total_segments, **params))
+
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        pages = dict(zip(keys, executor.map(read, keys)))
+
+    items = []
+    next_keys = {}
+    for (segment, (page, last_evaluated_key)) in sorted(pages.items()):
+        items.extend(page)
+        if last_evaluated_key:
+            next_keys[segment] = last_evaluated_key
+
+    return items, encode_segments_cursor(total_segments, next_keys)
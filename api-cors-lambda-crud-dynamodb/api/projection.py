@@ -0,0 +1,113 @@
+import os, re
+
+from expressions import parse_path
+
+# Field projection for the read endpoints: ?fields=a,b.c returns only those
+# attributes. The fields become a ProjectionExpression (so DynamoDB does not
+# send the other attributes over the wire), or are picked out of an item
+# that is already in memory, e.g. in the container cache.
+#
+# PROJECTABLE_FIELDS lists the top-level attributes that may be asked for
+# (comma separated, set by the stack from its projection settings). When it
+# is empty, projection is not enabled and ?fields= is rejected.
+
+MAX_PROJECTED_FIELDS = int(os.environ.get('MAX_PROJECTED_FIELDS', '50'))
+PROJECTABLE_FIELDS = [
+    name.strip() for name in os.environ.get('PROJECTABLE_FIELDS', '').split(',') if name.strip()
+]
+
+_INDEX = re.compile(r'\[(\d+)\]')
+
+
+def path_steps(path):
+    """
+    "a.b[0]" -> ("a", "b", 0)
+    """
+    steps = []
+    for (name, indexes) in parse_path(path):
+        steps.append(name)
+        steps.extend(int(index) for index in _INDEX.findall(indexes))
+    return tuple(steps)
+
+
+def parse_fields(params):
+    """
+    Read the `fields` query string parameter. Returns the list of paths, or
+    None when the whole item was asked for. Raises ValueError on malformed,
+    unknown or overlapping paths, so DynamoDB is never called with them.
+    """
+    value = params.get('fields', None)
+    if value is None:
+        return None
+    if not PROJECTABLE_FIELDS:
+        raise ValueError("invalid request, field projection is not enabled")
+
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',')))
+    if not all(fields):
+        raise ValueError("invalid request, fields must be a comma separated list of attribute paths")
+    if len(fields) > MAX_PROJECTED_FIELDS:
+        raise ValueError(f"invalid request, at most {MAX_PROJECTED_FIELDS} fields per request")
+
+    steps = [ path_steps(field) for field in fields ]
+
+    unknown = [ field for (field, path) in zip(fields, steps) if path[0] not in PROJECTABLE_FIELDS ]
+    if unknown:
+        raise ValueError(f"invalid request, unknown fields: {', '.join(unknown)}")
+
+    # DynamoDB rejects a projection in which one path contains another
+    for i in range(len(steps)):
+        for j in range(i + 1, len(steps)):
+            shorter, longer = sorted((steps[i], steps[j]), key=len)
+            if longer[:len(shorter)] == shorter:
+                raise ValueError(f"invalid request, overlapping fields '{fields[i]}' and '{fields[j]}'")
+
+    return fields
+
+
+def projection_params(builder, fields, required=()):
+    """
+    The ProjectionExpression kwarg for `fields`, plus the `required` top-level
+    attributes the handler itself needs (e.g. the primary key). Names go into
+    `builder`, so pass its params() along with the result.
+    """
+    paths = list(fields) + [ name for name in required if name not in fields ]
+    return {"ProjectionExpression": ", ".join(builder.path(path) for path in paths)}
+
+
+class _Slots(dict):
+    # list elements picked by index, in a projected item under construction
+    pass
+
+
+def _compact(value):
+    if isinstance(value, _Slots):
+        return [ _compact(value[index]) for index in sorted(value) ]
+    if isinstance(value, dict):
+        return { k: _compact(v) for (k, v) in value.items() }
+    return value
+
+
+def project_item(item, fields):
+    """
+    Apply a projection to an item in memory, the way DynamoDB would: missing
+    paths are left out, and picked list elements keep their relative order.
+    """
+    result = {}
+    for field in fields:
+        steps = path_steps(field)
+
+        value = item
+        for step in steps:
+            if isinstance(step, int):
+                if not isinstance(value, list) or step >= len(value):
+                    break
+            elif not isinstance(value, dict) or step not in value:
+                break
+            value = value[step]
+        else:
+            target = result
+            for (step, next_step) in zip(steps, steps[1:]):
+                target = target.setdefault(step, _Slots() if isinstance(next_step, int) else {})
+            target[steps[-1]] = value
+
+    return _compact(result)
@@ -0,0 +1,111 @@
+import base64, json, os
+from decimal import Decimal, InvalidOperation
+
+import pagination
+import projection
+from expressions import ExpressionBuilder
+
+# Query a global secondary index instead of scanning the table.
+#
+# INDEXES describes the table's GSIs, as declared in the stack:
+#   {"<index name>": {"partitionKey": {"name": ..., "type": "S"|"N"|"B"},
+#                     "sortKey": {"name": ..., "type": ...}}}
+
+INDEXES = json.loads(os.environ.get('INDEXES', '') or '{}')
+
+# query string parameter -> sort key condition
+SORT_KEY_CONDITIONS = {
+    'sk_eq': '=',
+    'sk_lt': '<',
+    'sk_lte': '<=',
+    'sk_gt': '>',
+    'sk_gte': '>=',
+    'sk_begins_with': 'begins_with',
+    'sk_between': 'between'
+}
+
+
+def typed_value(attribute, value):
+    """
+    Convert a query string value to the type of a key attribute.
+    """
+    attribute_type = attribute.get('type', 'S')
+    try:
+        if attribute_type == 'N':
+            return Decimal(value)
+        if attribute_type == 'B':
+            return base64.b64decode(value, validate=True)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"invalid request, {attribute['name']} must be of type {attribute_type}")
+    return value
+
+
+def build_query(params):
+    """
+    The kwargs of Table.query() for GET /items?index=<name>&key=<value>[&sk_<op>=...][&fields=...].
+    """
+    index_name = params.get('index', None)
+    index = INDEXES.get(index_name, None)
+    if index is None:
+        raise ValueError(f"invalid request, unknown index '{index_name}'")
+
+    key = params.get('key', None)
+    if key is None or key == '':
+        raise ValueError("invalid request, querying an index requires a key")
+
+    builder = ExpressionBuilder()
+    partition_key = index['partitionKey']
+    conditions = [
+        f"{builder.name(partition_key['name'])} = {builder.value(typed_value(partition_key, key))}"
+    ]
+
+    sort_conditions = [ name for name in SORT_KEY_CONDITIONS if params.get(name, None) is not None ]
+    if len(sort_conditions) > 1:
+        raise ValueError("invalid request, at most one sort key condition is allowed")
+
+    if sort_conditions:
+        sort_key = index.get('sortKey', None)
+        if sort_key is None:
+            raise ValueError(f"invalid request, index '{index_name}' has no sort key")
+
+        name = builder.name(sort_key['name'])
+        operator = SORT_KEY_CONDITIONS[sort_conditions[0]]
+        value = params[sort_conditions[0]]
+
+        if operator == 'between':
+            bounds = value.split(',')
+            if len(bounds) != 2:
+                raise ValueError("invalid request, sk_between takes two comma separated values")
+            low = builder.value(typed_value(sort_key, bounds[0]))
+            high = builder.value(typed_value(sort_key, bounds[1]))
+            conditions.append(f"{name} BETWEEN {low} AND {high}")
+        elif operator == 'begins_with':
+            conditions.append(f"begins_with({name}, {builder.value(typed_value(sort_key, value))})")
+        else:
+            conditions.append(f"{name} {operator} {builder.value(typed_value(sort_key, value))}")
+
+    order = params.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("invalid request, order must be asc or desc")
+
+    kwargs = {
+        "IndexName": index_name,
+        "KeyConditionExpression": " AND ".join(conditions),
+        "ScanIndexForward": order == 'asc'
+    }
+
+    fields = projection.parse_fields(params)
+    if fields:
+        kwargs.update(projection.projection_params(builder, fields))
+
+    kwargs.update(builder.params())
+    kwargs.update(pagination.parse_page_params(params))
+    return kwargs
+
+
+def query_page(table, params):
+    """
+    Query one page. Returns (items, next_cursor).
+    """
+    response = table.query(**build_query(params))
+    return response['Items'], pagination.encode_cursor(response.get('LastEvaluatedKey', None))
@@ -0,0 +1,87 @@
+import os
+
+import encoding
+
+# Support for the API Gateway stage cache (the response_cache stack option).
+#
+# API Gateway answers cached GETs without calling the function, so changed
+# items have to have their entries dropped. cache_invalidator.py does so
+# from the table's stream, off the request path of the writers, by sending
+# a signed GET for GET /items/{id} with `Cache-Control: max-age=0`: API
+# Gateway then refetches the entry from get_one (which reads straight from
+# DynamoDB for the invalidator's requests, see bypass_requested()) and
+# caches the fresh response. The ?fields= variants of the entry are not dropped, and expire
+# with the route's TTL.
+#
+# Cached responses are shared between clients, so get_one / get_all do not
+# compress them and do not answer 304s while the stage cache is on.
+
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+INVALIDATION_TIMEOUT = float(os.environ.get('RESPONSE_CACHE_INVALIDATION_TIMEOUT', '2'))
+# the stage's base URL, e.g. https://<api id>.execute-api.<region>.amazonaws.com/prod/
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+# the name of cache_invalidator.py's IAM role
+INVALIDATOR_ROLE = os.environ.get('RESPONSE_CACHE_INVALIDATOR_ROLE', '')
+
+_session = None
+
+
+def bypass_requested(event):
+    """
+    True if this is a cache invalidation request of cache_invalidator.py,
+    which must see the current item: `Cache-Control: max-age=0`, signed by
+    the invalidator's role, as API Gateway reports in the requestContext.
+    Other clients get the usual, cheaper read, whatever they send.
+    """
+    if not RESPONSE_CACHE_ENABLED or not INVALIDATOR_ROLE:
+        return False
+    directives = (encoding.get_header(event, 'Cache-Control') or '').replace(' ', '').lower().split(',')
+    if 'max-age=0' not in directives:
+        return False
+
+    # e.g. arn:aws:sts::123456789012:assumed-role/<role name>/<function name>
+    identity = (event.get("requestContext", None) or {}).get("identity", None) or {}
+    return f":assumed-role/{INVALIDATOR_ROLE}/" in (identity.get("userArn", None) or '')
+
+
+def credentials():
+    """
+    The function's credentials, to sign the invalidation requests with.
+    """
+    global _session
+    import boto3 # only the invalidator needs these: keep them off the readers' cold start
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session.get_credentials().get_frozen_credentials()
+
+
+def invalidate_item(item_id, signing_credentials):
+    """
+    Invalidate the stage cache entry of GET /items/{id}. Returns False if it
+    failed (the failure is logged): the entry then expires with its TTL.
+    """
+    import urllib.error, urllib.parse, urllib.request
+    from botocore.auth import SigV4Auth
+    from botocore.awsrequest import AWSRequest
+
+    url = f"{RESPONSE_CACHE_URL.rstrip('/')}/items/{urllib.parse.quote(str(item_id), safe='')}"
+    try:
+        request = AWSRequest(method='GET', url=url, headers={'Cache-Control': 'max-age=0'})
+        SigV4Auth(
+            signing_credentials, 'execute-api', os.environ.get('AWS_REGION', 'us-east-1')
+        ).add_auth(request)
+
+        with urllib.request.urlopen(
+            urllib.request.Request(url, headers=dict(request.headers.items())),
+            timeout=INVALIDATION_TIMEOUT
+        ) as response:
+            response.read()
+        return True
+
+    except urllib.error.HTTPError as e:
+        if e.code == 404: # e.g. after a DELETE
+            return True
+        print(f"Response cache invalidation of {url} failed: HTTP {e.code}")
+    except Exception as e:
+        print(f"Response cache invalidation of {url} failed: {str(e)}")
+    return False
@@ -0,0 +1,44 @@
+import importlib
+
+import encoding
+
+# Entry point of the single-function deployment (router_mode). API Gateway
+# sends every route to this function, and the request goes to the same
+# handler that serves the route in the per-function deployment.
+#
+# Handler modules are imported on first use, so a cold start only pays for
+# the route it is serving.
+
+ROUTES = {
+    ('GET', '/items'): 'get_all.handler',
+    ('POST', '/items'): 'create.handler',
+    ('POST', '/items/batch'): 'batch_create.handler',
+    ('POST', '/items/lookup'): 'batch_get.handler',
+    ('GET', '/items/stats'): 'get_stats.handler',
+    ('POST', '/items/export'): 'export_start.handler',
+    ('GET', '/items/export/{jobId}'): 'export_status.handler',
+    ('GET', '/items/{id}'): 'get_one.handler',
+    ('PATCH', '/items/{id}'): 'update_one.handler',
+    ('DELETE', '/items/{id}'): 'delete_one.handler'
+}
+
+_handlers = {}
+
+
+def resolve(target):
+    func = _handlers.get(target, None)
+    if func is None:
+        (module_name, func_name) = target.rsplit('.', 1)
+        func = getattr(importlib.import_module(module_name), func_name)
+        _handlers[target] = func
+    return func
+
+
+def handler(event, context):
+    route = (event.get("httpMethod", None), event.get("resource", None))
+
+    target = ROUTES.get(route, None)
+    if target is None:
+        return encoding.build_response(event, 404, {"description": f"No route for {route[0]} {route[1]}."})
+
+    return resolve(target)(event, context)
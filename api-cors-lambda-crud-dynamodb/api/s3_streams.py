@@ -0,0 +1,92 @@
+import os, zlib
+
+# Streaming to and from S3 without holding whole files in memory: gzip
+# compression into a multipart upload, and line-by-line reading of a
+# (possibly gzipped) object.
+
+PART_BYTES = int(os.environ.get('S3_PART_BYTES', str(8 * 1024 * 1024))) # S3 minimum: 5 MB
+READ_CHUNK_BYTES = int(os.environ.get('S3_READ_CHUNK_BYTES', str(1024 * 1024)))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '5'))
+
+
+class GzipMultipartUpload:
+    """
+    Compress what is written into one gzip stream, and upload it to S3 in
+    parts of PART_BYTES, so that the file never sits in memory whole.
+    """
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = s3.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType='application/gzip'
+        )['UploadId']
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip framing
+        self.buffer = bytearray()
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += self.compressor.compress(data)
+        if len(self.buffer) >= PART_BYTES:
+            self._upload_part()
+
+    def _upload_part(self):
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=bytes(self.buffer)
+        )
+        self.parts.append({"PartNumber": number, "ETag": response['ETag']})
+        self.buffer = bytearray()
+
+    def close(self):
+        self.buffer += self.compressor.flush()
+        self._upload_part() # the last part may be smaller than 5 MB
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def iter_lines(body, gzipped=False):
+    """
+    Yield the lines (bytes, without the line break) of a streaming body,
+    e.g. the Body of get_object, decompressing it on the fly if `gzipped`.
+    A gzip file may hold several members back to back (e.g. `cat a.gz b.gz`);
+    they are read in turn, as gunzip does.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    pending = b""
+
+    while True:
+        chunk = body.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if decompressor is not None:
+            chunk, decompressor = _gunzip(decompressor, chunk)
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+
+    if decompressor is not None:
+        pending += decompressor.flush()
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+def _gunzip(decompressor, data):
+    """
+    Decompress `data`, starting a new decompressor whenever a gzip member
+    ends. Returns the output and the decompressor to use for the next chunk.
+    """
+    out = decompressor.decompress(data)
+    while decompressor.eof and decompressor.unused_data:
+        rest = decompressor.unused_data
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out += decompressor.decompress(rest)
+    return out, decompressor
@@ -0,0 +1,133 @@
+import os
+from collections import Counter
+from decimal import Decimal
+
+import db
+import batching
+from expressions import ExpressionBuilder
+
+# Aggregates of the items table, kept up to date from its stream.
+#
+# stats_stream.py turns each batch of stream records into deltas: every
+# item contributes 1 to the count, its value of each STATS_SUM_ATTRIBUTES
+# to their sums and 1 to the count of its STATS_CATEGORY_ATTRIBUTE value.
+# A change takes the contribution of the old image off and adds the new
+# one. The deltas are ADDed to a single record of the stats table, which
+# GET /items/stats reads back with one GetItem.
+#
+# The record's attributes are flat ("count", "sum:<attribute>",
+# "category:<value>"), as ADD only works on top-level attributes.
+
+STATS_TABLE_NAME = os.environ.get('STATS_TABLE_NAME', '')
+STATS_SUM_ATTRIBUTES = [ name for name in os.environ.get('STATS_SUM_ATTRIBUTES', '').split(',') if name ]
+STATS_CATEGORY_ATTRIBUTE = os.environ.get('STATS_CATEGORY_ATTRIBUTE', '')
+
+STATS_ID = 'items'
+COUNT = 'count'
+SUM_PREFIX = 'sum:'
+CATEGORY_PREFIX = 'category:'
+# DynamoDB rejects update expressions of more than 4 KB; a batch with more
+# distinct categories than fit is applied in several updates
+MAX_EXPRESSION_CHARS = 3500
+
+
+def contribution(item):
+    """
+    What `item` (an item image, or None) adds to the aggregates.
+    """
+    if item is None:
+        return {}
+
+    parts = { COUNT: 1 }
+    for name in STATS_SUM_ATTRIBUTES:
+        value = item.get(name, None)
+        # booleans are ints in Python, but not numbers in DynamoDB
+        if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+            parts[SUM_PREFIX + name] = value
+    if STATS_CATEGORY_ATTRIBUTE:
+        category = item.get(STATS_CATEGORY_ATTRIBUTE, None)
+        if isinstance(category, (str, int, Decimal)) and not isinstance(category, bool):
+            parts[CATEGORY_PREFIX + str(category)] = 1
+    return parts
+
+
+def image(record, name):
+    raw = record.get("dynamodb", {}).get(name, None)
+    return batching.deserialize_item(raw) if raw is not None else None
+
+
+def deltas(records):
+    """
+    The changes a batch of stream records (NEW_AND_OLD_IMAGES) makes to
+    the aggregates, without the ones that cancel out.
+    """
+    total = Counter()
+    for record in records:
+        for (name, value) in contribution(image(record, "OldImage")).items():
+            total[name] -= value
+        for (name, value) in contribution(image(record, "NewImage")).items():
+            total[name] += value
+    return { name: value for (name, value) in total.items() if value != 0 }
+
+
+def chunks(changes):
+    """
+    Split `changes` into the groups of ADDs that fit in one update
+    expression (placeholders are numbered from 0 in each).
+    """
+    chunk = []
+    size = 0
+    for (i, change) in enumerate(changes.items()):
+        # ", #n<i> :v<i>", with the updatedAt SET taking #n0 / :v0
+        term = 2 * len(str(i + 1)) + 7
+        if chunk and size + term > MAX_EXPRESSION_CHARS:
+            yield dict(chunk)
+            chunk = []
+            size = 0
+        chunk.append(change)
+        size += term
+    if chunk:
+        yield dict(chunk)
+
+
+def apply(changes, updated_at, token):
+    """
+    ADD `changes` to the stats record. Each update is a transaction only
+    for its ClientRequestToken (`token`, suffixed with the number of the
+    chunk): a retry with the same token and the same parameters within ten
+    minutes is not applied twice, so when the batch is retried after a
+    failure, the chunks that went through are not counted twice. That only
+    holds for a retry of the same batch, with the same `changes`;
+    `updated_at` must come from the batch itself for that too.
+    """
+    for (number, chunk) in enumerate(chunks(changes)):
+        builder = ExpressionBuilder()
+        expression = f"SET {builder.name('updatedAt')} = {builder.value(updated_at)} ADD "
+        expression += ", ".join(f"{builder.name(name)} {builder.value(value)}" for (name, value) in chunk.items())
+        params = builder.params()
+
+        db.get_client().transact_write_items(
+            TransactItems=[{
+                "Update": {
+                    "TableName": STATS_TABLE_NAME,
+                    "Key": batching.serialize_item({ "statId": STATS_ID }),
+                    "UpdateExpression": expression,
+                    "ExpressionAttributeNames": params["ExpressionAttributeNames"],
+                    "ExpressionAttributeValues": batching.serialize_item(params["ExpressionAttributeValues"])
+                }
+            }],
+            ClientRequestToken=f"{token}-{number}"
+        )
+
+
+def read_stats():
+    record = db.get_table(STATS_TABLE_NAME).get_item(Key={ "statId": STATS_ID }).get('Item', None) or {}
+    return {
+        "count": record.get(COUNT, 0),
+        "sums": { name: record.get(SUM_PREFIX + name, 0) for name in STATS_SUM_ATTRIBUTES },
+        "categories": {
+            name[len(CATEGORY_PREFIX):]: value
+            for (name, value) in record.items() if name.startswith(CATEGORY_PREFIX) and value != 0
+        },
+        "updatedAt": record.get("updatedAt", None)
+    }
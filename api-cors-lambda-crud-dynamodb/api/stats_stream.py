@@ -0,0 +1,32 @@
+import hashlib, json
+
+import stats
+
+# Consumer of the items table's stream: applies each batch of records to
+# the aggregates read by GET /items/stats (see stats.py).
+#
+# Errors are raised on purpose: Lambda then retries the same batch (see
+# api_stack.py), and the ClientRequestTokens (derived from the batch's
+# event IDs) keep the updates that went through before the failure from
+# being applied twice. For that, the requests must be the same on every
+# retry: their updatedAt is the time of the batch's latest record, not the
+# time it is processed. This is also why the batch must not be split on
+# failure: each half would get tokens of its own.
+
+
+def request_token(records):
+    digest = hashlib.sha256("\n".join(record["eventID"] for record in records).encode('utf-8'))
+    # DynamoDB accepts tokens of up to 36 characters, stats.apply() adds "-<chunk>"
+    return digest.hexdigest()[:32]
+
+
+def updated_at(records):
+    return int(max(record["dynamodb"]["ApproximateCreationDateTime"] for record in records))
+
+
+def handler(event, context):
+    records = event.get("Records", [])
+    changes = stats.deltas(records)
+    if changes:
+        stats.apply(changes, updated_at(records), request_token(records))
+    print(json.dumps({ "records": len(records), "changes": len(changes) }))
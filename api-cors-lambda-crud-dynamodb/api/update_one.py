@@ -1,13 +1,110 @@
-import json, os
-import boto3
+import os
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+import db
+import encoding
+import metrics
+import cache
+from expressions import ExpressionBuilder, parse_path
 
 TABLE_NAME = os.environ.get('TABLE_NAME', '')
 PRIMARY_KEY = os.environ.get('PRIMARY_KEY', '')
 
+OPERATORS = ('$set', '$remove', '$add', '$append')
+
+def is_number(value):
+    # JSON true and false are bools, which are ints in Python
+    return isinstance(value, (int, Decimal)) and not isinstance(value, bool)
+
+def is_integer(value):
+    return is_number(value) and value == int(value)
+
+def build_update(item_id, request):
+    """
+    Translate a PATCH body into the kwargs of a single update_item call.
+
+    The body is either a plain object of attributes to SET (the original
+    format), or an object of operators on document paths:
+        {"$set": {"a.b": "x"}, "$remove": ["c"], "$add": {"views": 1},
+         "$append": {"tags": ["new"]}}
+    Either format may carry "expectedVersion", which makes the update
+    conditional on the item's current version.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("invalid request, body must be a JSON object")
+
+    request = dict(request)
+    expected_version = request.pop("expectedVersion", None)
+
+    if any(key in OPERATORS for key in request):
+        unknown = [ key for key in request if key not in OPERATORS ]
+        if unknown:
+            raise ValueError(f"invalid request, unknown operators: {', '.join(unknown)}")
+        sets = request.get("$set", {})
+        removes = request.get("$remove", [])
+        adds = request.get("$add", {})
+        appends = request.get("$append", {})
+    else:
+        sets, removes, adds, appends = request, [], {}, {}
+
+    if not isinstance(sets, dict) or not isinstance(adds, dict) or not isinstance(appends, dict):
+        raise ValueError("invalid request, $set, $add and $append take an object of paths to values")
+    if not isinstance(removes, list):
+        raise ValueError("invalid request, $remove takes a list of paths")
+    if not all(is_number(value) for value in adds.values()):
+        raise ValueError("invalid request, $add only takes numbers")
+    if not all(isinstance(value, list) for value in appends.values()):
+        raise ValueError("invalid request, $append only takes lists")
+    if not (sets or removes or adds or appends):
+        raise ValueError("invalid request, no arguments provided")
+
+    for path in list(sets) + removes + list(adds) + list(appends):
+        if parse_path(path)[0][0] in (PRIMARY_KEY, cache.VERSION_ATTRIBUTE):
+            raise ValueError(f"invalid request, {PRIMARY_KEY} and {cache.VERSION_ATTRIBUTE} cannot be updated")
+
+    builder = ExpressionBuilder()
+
+    set_clauses = [ f"{builder.path(path)} = {builder.value(value)}" for (path, value) in sets.items() ]
+    for (path, value) in appends.items():
+        path = builder.path(path)
+        set_clauses.append(f"{path} = list_append(if_not_exists({path}, {builder.value([])}), {builder.value(value)})")
+
+    remove_clauses = [ builder.path(path) for path in removes ]
+
+    add_clauses = [ f"{builder.path(path)} {builder.value(value)}" for (path, value) in adds.items() ]
+    # bump the version, so that cached copies of this item get invalidated
+    add_clauses.append(f"{builder.name(cache.VERSION_ATTRIBUTE)} {builder.value(1)}")
+
+    expression = []
+    if set_clauses:
+        expression.append("SET " + ", ".join(set_clauses))
+    if remove_clauses:
+        expression.append("REMOVE " + ", ".join(remove_clauses))
+    expression.append("ADD " + ", ".join(add_clauses))
+
+    params = {
+        "Key": { PRIMARY_KEY: item_id },
+        "UpdateExpression": " ".join(expression),
+        "ReturnValues": "UPDATED_NEW"
+    }
+
+    if expected_version is not None:
+        if not is_integer(expected_version):
+            raise ValueError("invalid request, expectedVersion must be an integer")
+        version = builder.name(cache.VERSION_ATTRIBUTE)
+        params["ConditionExpression"] = f"{version} = {builder.value(expected_version)}"
+
+    params.update(builder.params())
+    return params
+
+@metrics.instrumented
 def handler(event, context):
 
+    headers = {}
+
     try:
-        body = event.get("body", None)
+        body = encoding.read_body(event)
         if body is None:
             raise ValueError("invalid request, you are missing the parameter body")
         
@@ -19,40 +116,37 @@ def handler(event, context):
         if req_item_id is None:
             raise ValueError("invalid request, you are missing the path parameter id")
         
-        edited_item = json.loads(body)
-        edited_item_props = list(edited_item.keys())
-        if not edited_item_props:
-            raise ValueError("invalid request, no arguments provided")
-        
-        first_prop = edited_item_props[0]
-        params = {
-            "Key": { PRIMARY_KEY: req_item_id },
-            "UpdateExpression": f"SET {first_prop} = :{first_prop}",
-            "ExpressionAttributeValues": {},
-            "ReturnValues": "UPDATED_NEW"
-        }
-        params["ExpressionAttributeValues"][f":{first_prop}"] = edited_item[f"{first_prop}"]
-        
-        edited_item.pop(first_prop) # delete the first item, caz we've already taken care of it
+        params = build_update(req_item_id, encoding.loads(body))
 
-        for (key, val) in edited_item.items():
-            params["UpdateExpression"] += f", {key} = :{key}"
-            params["ExpressionAttributeValues"][f":{key}"] = val
-        
-        ddb = boto3.resource('dynamodb')
-        table = ddb.Table(TABLE_NAME)
-        response = table.update_item(**params)
+        table = db.get_table(TABLE_NAME)
+        try:
+            response = table.update_item(**params)
+        finally:
+            cache.item_cache.evict(req_item_id) # matters when get_one shares this container (router mode)
 
+        headers["ETag"] = cache.make_etag(req_item_id, response['Attributes'])
         status_code = 204
-        resp = {}
+        resp = None
     
     except ValueError as e:
         status_code = 400
         resp = {"description": f"Bad request. {str(e)}"}
+
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'ConditionalCheckFailedException':
+            status_code = 409
+            resp = {"description": "Conflict. The item does not exist or its version is not expectedVersion."}
+        elif code == 'ValidationException':
+            # e.g. overlapping paths, or $add on an attribute that is not a number
+            status_code = 400
+            resp = {"description": f"Bad request. {e.response['Error']['Message']}"}
+        else:
+            status_code = 500
+            resp = {"description": f"Internal server error. {str(e)}"}
     
     except Exception as e:
         status_code = 500
         resp = {"description": f"Internal server error. {str(e)}"}
 
-    return { "statusCode": status_code, "body": json.dumps(resp) }
-
+    return encoding.build_response(event, status_code, resp, headers)
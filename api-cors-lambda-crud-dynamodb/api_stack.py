@@ -1,17 +1,211 @@
 #!/usr/bin/env python3
+import json, os
 
 from aws_cdk import (
     core,
     aws_lambda as _lambda,
     aws_dynamodb as ddb,
-    aws_apigateway as apigw
+    aws_apigateway as apigw,
+    aws_cloudwatch as cloudwatch,
+    aws_dax as dax,
+    aws_ec2 as ec2,
+    aws_iam as iam,
+    aws_s3 as s3,
+    aws_s3_notifications as s3n,
+    aws_sqs as sqs
 )
 
+import bundle
+
+# namespace and dimension of the metrics the handlers log (see api/metrics.py)
+METRICS_NAMESPACE = 'ItemsService'
+ROUTES = [
+    'GET /items', 'POST /items', 'POST /items/batch', 'POST /items/lookup', 'GET /items/stats',
+    'GET /items/{id}', 'PATCH /items/{id}', 'DELETE /items/{id}',
+    'POST /items/export', 'GET /items/export/{jobId}'
+]
+
+ATTRIBUTE_TYPES = {
+    'S': ddb.AttributeType.STRING,
+    'N': ddb.AttributeType.NUMBER,
+    'B': ddb.AttributeType.BINARY
+}
+
+def key_attribute(spec: dict) -> ddb.Attribute:
+    # {"name": ..., "type": "S" | "N" | "B"} -> ddb.Attribute
+    if not spec.get('name', None) or spec.get('type', 'S') not in ATTRIBUTE_TYPES:
+        raise ValueError(f"invalid key attribute {spec}, expected {{'name': ..., 'type': 'S' | 'N' | 'B'}}")
+    return ddb.Attribute(name=spec['name'], type=ATTRIBUTE_TYPES[spec.get('type', 'S')])
+
+BILLING_MODES = {
+    'PAY_PER_REQUEST': ddb.BillingMode.PAY_PER_REQUEST,
+    'PROVISIONED': ddb.BillingMode.PROVISIONED
+}
+
+def check_capacity(capacity: dict) -> dict:
+    """
+    Validate the capacity settings of the table, e.g.
+        {"billingMode": "PROVISIONED", "readCapacity": 10, "writeCapacity": 5,
+         "autoscaling": {"read": {"min": 5, "max": 100, "targetUtilization": 70}}}
+    and fill in the defaults. Raises ValueError on combinations that make no sense.
+    """
+    capacity = dict(capacity or {})
+    billing_mode = capacity.setdefault('billingMode', 'PROVISIONED')
+    if billing_mode not in BILLING_MODES:
+        raise ValueError(f"invalid billingMode {billing_mode}, expected one of {', '.join(BILLING_MODES)}")
+
+    autoscaling = capacity['autoscaling'] = {
+        kind: dict(scaling) for (kind, scaling) in (capacity.get('autoscaling', None) or {}).items()
+    }
+    if billing_mode == 'PAY_PER_REQUEST':
+        if 'readCapacity' in capacity or 'writeCapacity' in capacity or autoscaling:
+            raise ValueError("PAY_PER_REQUEST tables take no readCapacity, writeCapacity or autoscaling")
+        return capacity
+
+    unknown = [ key for key in autoscaling if key not in ('read', 'write') ]
+    if unknown:
+        raise ValueError(f"invalid autoscaling settings {unknown}, expected read and/or write")
+
+    for kind in ('read', 'write'):
+        units = capacity.setdefault(f'{kind}Capacity', 5)
+        if not isinstance(units, int) or units < 1:
+            raise ValueError(f"{kind}Capacity must be a positive integer")
+
+        scaling = autoscaling.get(kind, None)
+        if scaling is None:
+            continue
+        low, high = scaling.get('min', units), scaling.get('max', None)
+        target = scaling.setdefault('targetUtilization', 70)
+        if not isinstance(high, int) or not isinstance(low, int) or not 1 <= low <= high:
+            raise ValueError(f"{kind} autoscaling needs 1 <= min <= max, got min={low} max={high}")
+        if not low <= units <= high:
+            raise ValueError(f"{kind}Capacity {units} is outside of the autoscaling range {low}-{high}")
+        if not 20 <= target <= 90:
+            raise ValueError(f"{kind} targetUtilization must be between 20 and 90 percent")
+        scaling['min'] = low
+
+    return capacity
+
+def check_dax(settings: dict) -> dict:
+    """
+    Validate the DAX cluster settings and fill in the defaults, e.g.
+        {"nodeType": "dax.r4.large", "replicationFactor": 3, "itemTtlMs": 5000, "queryTtlMs": 5000}
+    """
+    settings = dict(settings)
+    settings.setdefault('nodeType', 'dax.t2.small')
+    replication_factor = settings.setdefault('replicationFactor', 3)
+    if not isinstance(replication_factor, int) or not 1 <= replication_factor <= 10:
+        raise ValueError("DAX replicationFactor must be between 1 and 10")
+    for key in ('itemTtlMs', 'queryTtlMs'):
+        # items are written straight to DynamoDB, so DAX only learns about changes when its entries expire
+        ttl = settings.setdefault(key, 5000)
+        if not isinstance(ttl, int) or ttl < 0:
+            raise ValueError(f"DAX {key} must be a non-negative integer")
+    return settings
+
+CACHE_CLUSTER_SIZES = ('0.5', '1.6', '6.1', '13.5', '28.4', '58.2', '118', '237')
+CACHEABLE_ROUTES = {
+    # route -> stage method setting path
+    'GET /items': '/items/GET',
+    'GET /items/{id}': '/items/{id}/GET'
+}
+
+# ?fields= entries of GET /items/{id} are not invalidated on writes, so with
+# projection on, that route's TTL is also how stale they can get
+MAX_PROJECTED_CACHE_TTL = 60
+
+def check_response_cache(settings: dict, projection_enabled: bool = False) -> dict:
+    """
+    Validate the API Gateway stage cache settings and fill in the defaults, e.g.
+        {"clusterSize": "0.5", "ttlSeconds": {"GET /items/{id}": 300, "GET /items": 30}}
+    A TTL of 0 turns caching off for that route.
+    """
+    settings = dict(settings)
+    cluster_size = settings.setdefault('clusterSize', '0.5')
+    if cluster_size not in CACHE_CLUSTER_SIZES:
+        raise ValueError(f"invalid cache clusterSize {cluster_size}, expected one of {', '.join(CACHE_CLUSTER_SIZES)}")
+
+    default_item_ttl = MAX_PROJECTED_CACHE_TTL if projection_enabled else 300
+    ttls = { 'GET /items/{id}': default_item_ttl, 'GET /items': 30, **settings.get('ttlSeconds', {}) }
+    for (route, ttl) in ttls.items():
+        if route not in CACHEABLE_ROUTES:
+            raise ValueError(f"invalid cache route {route}, expected one of {', '.join(CACHEABLE_ROUTES)}")
+        if not isinstance(ttl, int) or not 0 <= ttl <= 3600:
+            raise ValueError(f"cache TTL of {route} must be between 0 and 3600 seconds")
+    if projection_enabled and ttls['GET /items/{id}'] > MAX_PROJECTED_CACHE_TTL:
+        raise ValueError(
+            f"with projection, the cache TTL of GET /items/{{id}} must be at most {MAX_PROJECTED_CACHE_TTL} seconds: "
+            "its ?fields= entries are not invalidated on writes"
+        )
+    settings['ttlSeconds'] = ttls
+    return settings
+
+def check_stats(settings: dict) -> dict:
+    """
+    Validate the settings of the aggregates behind GET /items/stats, e.g.
+        {"sumAttributes": ["price", "stock"], "categoryAttribute": "category"}
+    The item count is always kept.
+    """
+    settings = dict(settings or {})
+    sums = settings.setdefault('sumAttributes', [])
+    if not isinstance(sums, list) or not all(isinstance(name, str) and name for name in sums):
+        raise ValueError("stats sumAttributes must be a list of attribute names")
+    if any(',' in name for name in sums):
+        raise ValueError("stats sumAttributes cannot contain commas")
+    category = settings.setdefault('categoryAttribute', None)
+    if category is not None and (not isinstance(category, str) or not category):
+        raise ValueError("stats categoryAttribute must be an attribute name")
+    return settings
+
+def check_projection(settings: dict) -> dict:
+    """
+    Validate the settings of ?fields= projection on the read endpoints, e.g.
+        {"fields": ["name", "price", "address"]}
+    "fields" lists the top-level attributes that may be asked for, and is
+    required: the items have no schema, so without it every field would be
+    "known".
+    """
+    settings = dict(settings)
+    fields = settings.get('fields', None)
+    if not isinstance(fields, list) or not fields:
+        raise ValueError("projection needs fields, the list of top-level attributes that may be asked for")
+    if not all(isinstance(name, str) and name for name in fields):
+        raise ValueError("projection fields must be attribute names")
+    invalid = [ name for name in fields if any(c in name for c in ',.[]') ]
+    if invalid:
+        raise ValueError(f"projection fields must be top-level attribute names, got {', '.join(invalid)}")
+    return settings
+
 class ApiLambdaCrudDynamoDBStack(core.Stack):
 
-    def __init__(self, scope: core.Stack, id: str, **kwargs) -> None:
+    def __init__(self, scope: core.Stack, id: str, parallel_scan: bool = False,
+                 router_mode: bool = False, global_secondary_indexes: list = None,
+                 latency_alarm_ms: int = 1000, capacity: dict = None, ttl_attribute: str = None,
+                 dax_cluster: dict = None, response_cache: dict = None, stats: dict = None,
+                 projection: dict = None,
+                 bundle_dir: str = None,
+                 **kwargs) -> None:
         super().__init__(scope, id, **kwargs)
 
+        # each function ships either the whole api/ directory, or its own
+        # minimal bundle from bundle_dir (built by bundle.py)
+        def handler_code(module):
+            if bundle_dir is None:
+                return _lambda.AssetCode('api')
+            return _lambda.AssetCode(os.path.join(bundle_dir, module))
+
+        # capacity mode (see check_capacity()), shared by the table and its indexes
+        capacity = check_capacity(capacity)
+        provisioned = capacity['billingMode'] == 'PROVISIONED'
+        throughput = {
+            'read_capacity': capacity['readCapacity'],
+            'write_capacity': capacity['writeCapacity']
+        } if provisioned else {}
+
+        # items with a number (epoch seconds) in ttl_attribute are deleted by DynamoDB once it is past
+        if ttl_attribute is not None and ttl_attribute in ('', 'itemID', 'version'):
+            raise ValueError(f"invalid ttl_attribute '{ttl_attribute}'")
+
         # create a dynamo db table
         dynamo_table = ddb.Table(
             self, 'items',
@@ -20,94 +214,594 @@ class ApiLambdaCrudDynamoDBStack(core.Stack):
                 'type': ddb.AttributeType.STRING
             },
             table_name='items',
-            removal_policy=core.RemovalPolicy.DESTROY # NOT recommended for production code
+            billing_mode=BILLING_MODES[capacity['billingMode']],
+            time_to_live_attribute=ttl_attribute,
+            # every change goes to the stream, read by the aggregates consumer below
+            stream=ddb.StreamViewType.NEW_AND_OLD_IMAGES,
+            removal_policy=core.RemovalPolicy.DESTROY, # NOT recommended for production code
+            **throughput
         )
 
-        get_one_lambda = _lambda.Function(
-            self, 'getOneItemFunction',
-            code=_lambda.AssetCode('api'),
-            handler='get_one.handler',
-            runtime=_lambda.Runtime.PYTHON_3_7,
-            environment={
-                "TABLE_NAME": dynamo_table.table_name,
-                "PRIMARY_KEY": 'itemID'
+        # global secondary indexes, e.g.
+        #   [{"name": "byCategory", "partitionKey": {"name": "category", "type": "S"},
+        #     "sortKey": {"name": "price", "type": "N"}}]
+        # GET /items?index=<name>&key=<value> queries them (see api/query.py)
+        indexes = {}
+        for gsi in global_secondary_indexes or []:
+            if not gsi.get('name', None) or 'partitionKey' not in gsi:
+                raise ValueError(f"invalid global secondary index {gsi}, name and partitionKey are required")
+
+            dynamo_table.add_global_secondary_index(
+                index_name=gsi['name'],
+                partition_key=key_attribute(gsi['partitionKey']),
+                sort_key=key_attribute(gsi['sortKey']) if 'sortKey' in gsi else None,
+                projection_type=ddb.ProjectionType.ALL,
+                **throughput
+            )
+            indexes[gsi['name']] = {
+                key: { 'name': gsi[key]['name'], 'type': gsi[key].get('type', 'S') }
+                for key in ('partitionKey', 'sortKey') if key in gsi
             }
-        )
 
-        get_all_lambda = _lambda.Function(
-            self, 'getAllItemsFunction',
-            code=_lambda.AssetCode('api'),
-            handler='get_all.handler',
-            runtime=_lambda.Runtime.PYTHON_3_7,
-            environment={
-                "TABLE_NAME": dynamo_table.table_name,
-                "PRIMARY_KEY": 'itemID'
+        # target tracking autoscaling of the provisioned capacity, on the table and every index
+        for (kind, scaling) in capacity['autoscaling'].items():
+            limits = { 'min_capacity': scaling['min'], 'max_capacity': scaling['max'] }
+            scalables = [
+                dynamo_table.auto_scale_read_capacity(**limits) if kind == 'read'
+                else dynamo_table.auto_scale_write_capacity(**limits)
+            ]
+            for index_name in indexes:
+                scalables.append(
+                    dynamo_table.auto_scale_global_secondary_index_read_capacity(index_name, **limits) if kind == 'read'
+                    else dynamo_table.auto_scale_global_secondary_index_write_capacity(index_name, **limits)
+                )
+            for scalable in scalables:
+                scalable.scale_on_utilization(target_utilization_percent=scaling['targetUtilization'])
+
+        # optional DAX cluster in front of the table, for the read path (get_one / get_all).
+        # The readers move into a VPC of isolated subnets, with a gateway endpoint for DynamoDB
+        reader_options = {}
+        reader_env = {}
+        if dax_cluster is not None:
+            dax_settings = check_dax(dax_cluster)
+            # the readers would fail on their first import of api/db.py without it
+            if not bundle.vendored_files('amazondax', bundle.API_DIR):
+                raise ValueError("dax_cluster needs the amazondax package in api/: pip install amazon-dax-client -t api/")
+
+            vpc = ec2.Vpc(
+                self, 'vpc',
+                max_azs=3,
+                nat_gateways=0,
+                subnet_configuration=[
+                    ec2.SubnetConfiguration(name='isolated', subnet_type=ec2.SubnetType.ISOLATED)
+                ]
+            )
+            vpc.add_gateway_endpoint('dynamoDbEndpoint', service=ec2.GatewayVpcEndpointAwsService.DYNAMODB)
+            subnets = vpc.select_subnets(subnet_type=ec2.SubnetType.ISOLATED)
+
+            reader_sg = ec2.SecurityGroup(self, 'readerSecurityGroup', vpc=vpc)
+            dax_sg = ec2.SecurityGroup(self, 'daxSecurityGroup', vpc=vpc, allow_all_outbound=False)
+            dax_sg.add_ingress_rule(reader_sg, ec2.Port.tcp(8111), 'DAX clients')
+
+            dax_role = iam.Role(self, 'daxRole', assumed_by=iam.ServicePrincipal('dax.amazonaws.com'))
+            dynamo_table.grant_read_write_data(dax_role)
+
+            dax_subnet_group = dax.CfnSubnetGroup(
+                self, 'daxSubnetGroup',
+                subnet_ids=subnets.subnet_ids,
+                description='Items DAX cluster'
+            )
+            dax_parameter_group = dax.CfnParameterGroup(
+                self, 'daxParameterGroup',
+                parameter_name_values={
+                    'record-ttl-millis': str(dax_settings['itemTtlMs']),
+                    'query-ttl-millis': str(dax_settings['queryTtlMs'])
+                },
+                description='Items DAX cluster'
+            )
+            dax_cache = dax.CfnCluster(
+                self, 'daxCluster',
+                iam_role_arn=dax_role.role_arn,
+                node_type=dax_settings['nodeType'],
+                replication_factor=dax_settings['replicationFactor'],
+                subnet_group_name=dax_subnet_group.ref,
+                parameter_group_name=dax_parameter_group.ref,
+                security_group_ids=[dax_sg.security_group_id]
+            )
+
+            reader_options = {
+                'vpc': vpc,
+                'vpc_subnets': ec2.SubnetSelection(subnet_type=ec2.SubnetType.ISOLATED),
+                'security_group': reader_sg
             }
+            reader_env = {
+                "DAX_ENDPOINT": f"dax://{dax_cache.attr_cluster_discovery_endpoint}"
+            }
+
+        # background jobs (exports): their records, and the bucket the exports are written to
+        jobs_table = ddb.Table(
+            self, 'jobs',
+            partition_key={
+                'name': 'jobId',
+                'type': ddb.AttributeType.STRING
+            },
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute='expiresAt',
+            removal_policy=core.RemovalPolicy.DESTROY # NOT recommended for production code
+        )
+
+        export_bucket = s3.Bucket(
+            self, 'exportBucket',
+            lifecycle_rules=[s3.LifecycleRule(
+                expiration=core.Duration.days(7),
+                abort_incomplete_multipart_upload_after=core.Duration.days(1)
+            )],
+            removal_policy=core.RemovalPolicy.DESTROY # NOT recommended for production code
+        )
+
+        # aggregates of the items table (see check_stats()), one record kept up to date from the stream
+        stats_settings = check_stats(stats)
+        stats_table = ddb.Table(
+            self, 'stats',
+            partition_key={
+                'name': 'statId',
+                'type': ddb.AttributeType.STRING
+            },
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=core.RemovalPolicy.DESTROY # NOT recommended for production code
         )
 
-        create_one = _lambda.Function(
-            self, 'createItemFunction',
-            code=_lambda.AssetCode('api'),
-            handler='create.handler',
+        # ?fields= on the read endpoints, with the attributes that may be asked for
+        # (see check_projection()); when it is off, the handlers reject ?fields=
+        projection_settings = check_projection(projection) if projection is not None else { 'fields': [] }
+
+        # the role of the stage cache invalidator (the function is made below the API).
+        # It is made up front, so that get_one can tell the invalidator's requests by it
+        invalidator_role = None
+        if response_cache is not None:
+            invalidator_role = iam.Role(
+                self, 'cacheInvalidatorRole',
+                assumed_by=iam.ServicePrincipal('lambda.amazonaws.com'),
+                managed_policies=[
+                    iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole')
+                ]
+            )
+
+        # environment shared by all handlers. DDB_PREWARM makes api/db.py open
+        # its DynamoDB connection during the init phase of a cold start
+        lambda_env = {
+            "TABLE_NAME": dynamo_table.table_name,
+            "PRIMARY_KEY": 'itemID',
+            "DDB_PREWARM": 'true',
+            "INDEXES": json.dumps(indexes),
+            "METRICS_NAMESPACE": METRICS_NAMESPACE,
+            "RESPONSE_CACHE_ENABLED": str(response_cache is not None).lower(),
+            "RESPONSE_CACHE_INVALIDATOR_ROLE": invalidator_role.role_name if invalidator_role is not None else '',
+            "JOBS_TABLE_NAME": jobs_table.table_name,
+            "EXPORT_BUCKET": export_bucket.bucket_name,
+            "STATS_TABLE_NAME": stats_table.table_name,
+            "STATS_SUM_ATTRIBUTES": ",".join(stats_settings['sumAttributes']),
+            "STATS_CATEGORY_ATTRIBUTE": stats_settings['categoryAttribute'] or '',
+            "PROJECTABLE_FIELDS": ",".join(projection_settings['fields'])
+        }
+
+        # the export worker re-invokes itself to continue a long segment, so it
+        # gets a fixed name: granting it access to its own ARN would be a cycle
+        export_worker_name = f"{self.stack_name}-exportWorker"
+        export_worker = _lambda.Function(
+            self, 'exportWorkerFunction',
+            function_name=export_worker_name,
+            code=handler_code('export_worker'),
+            handler='export_worker.handler',
             runtime=_lambda.Runtime.PYTHON_3_7,
-            environment={
-                "TABLE_NAME": dynamo_table.table_name,
-                "PRIMARY_KEY": 'itemID'
-            }
+            timeout=core.Duration.minutes(15),
+            memory_size=1024,
+            environment=lambda_env
         )
+        dynamo_table.grant_read_data(export_worker)
+        jobs_table.grant_read_write_data(export_worker)
+        export_bucket.grant_write(export_worker)
+        export_worker.add_to_role_policy(iam.PolicyStatement(
+            actions=['lambda:InvokeFunction'],
+            resources=[f"arn:{core.Aws.PARTITION}:lambda:{self.region}:{self.account}:function:{export_worker_name}"]
+        ))
+        export_env = { "EXPORT_WORKER_FUNCTION": export_worker_name }
 
-        update_one = _lambda.Function(
-            self, "updateItemFunction",
-            code=_lambda.AssetCode('api'),
-            handler='update_one.handler',
+        # NDJSON files put under incoming/ are imported into the items table;
+        # the worker writes its reports under reports/, outside the trigger
+        import_bucket = s3.Bucket(
+            self, 'importBucket',
+            lifecycle_rules=[s3.LifecycleRule(abort_incomplete_multipart_upload_after=core.Duration.days(1))],
+            removal_policy=core.RemovalPolicy.DESTROY # NOT recommended for production code
+        )
+        import_worker = _lambda.Function(
+            self, 'importWorkerFunction',
+            code=handler_code('import_worker'),
+            handler='import_worker.handler',
             runtime=_lambda.Runtime.PYTHON_3_7,
-            environment={
-                "TABLE_NAME": dynamo_table.table_name,
-                "PRIMARY_KEY": 'itemID'
+            timeout=core.Duration.minutes(15),
+            memory_size=1024,
+            environment=lambda_env
+        )
+        # S3 invokes the worker asynchronously, and Lambda would retry a failed or timed out
+        # import twice, giving the rows without an itemID new keys each time. Not in the
+        # Function construct of this CDK version
+        core.CfnResource(
+            self, 'importWorkerInvokeConfig',
+            type='AWS::Lambda::EventInvokeConfig',
+            properties={
+                'FunctionName': import_worker.function_name,
+                'Qualifier': '$LATEST',
+                'MaximumRetryAttempts': 0
             }
         )
+        dynamo_table.grant_read_write_data(import_worker)
+        import_bucket.grant_read_write(import_worker)
+        import_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.LambdaDestination(import_worker),
+            s3.NotificationKeyFilter(prefix='incoming/')
+        )
 
-        delete_one = _lambda.Function(
-            self, 'deleteItemFunction',
-            code=_lambda.AssetCode('api'),
-            handler='delete_one.handler',
+        # one batch of records at a time per stream shard. A failed batch is retried
+        # whole, and not split in two: a retry is only skipped by DynamoDB if it is the
+        # same request (see stats.apply()), and halves of a batch are not. The retries
+        # of a batch must all fall within the ten minutes a ClientRequestToken is
+        # remembered: 9 attempts of at most 60 seconds. The batches that still fail
+        # are given up on and described in the failure queue
+        stats_failures = sqs.Queue(
+            self, 'statsStreamFailures',
+            retention_period=core.Duration.days(14)
+        )
+        stats_stream = _lambda.Function(
+            self, 'statsStreamFunction',
+            code=handler_code('stats_stream'),
+            handler='stats_stream.handler',
             runtime=_lambda.Runtime.PYTHON_3_7,
-            environment={
-                "TABLE_NAME": dynamo_table.table_name,
-                "PRIMARY_KEY": 'itemID'
-            }
+            timeout=core.Duration.seconds(60),
+            environment=lambda_env
+        )
+        stats_mapping = stats_stream.add_event_source_mapping(
+            'itemsStream',
+            event_source_arn=dynamo_table.table_stream_arn,
+            starting_position=_lambda.StartingPosition.TRIM_HORIZON,
+            batch_size=1000
         )
+        # not in the EventSourceMapping construct of this CDK version
+        mapping_resource = stats_mapping.node.find_child('Resource')
+        mapping_resource.add_property_override('BisectBatchOnFunctionError', False)
+        mapping_resource.add_property_override('MaximumRetryAttempts', 8)
+        mapping_resource.add_property_override(
+            'DestinationConfig', { 'OnFailure': { 'Destination': stats_failures.queue_arn } }
+        )
+        dynamo_table.grant_stream_read(stats_stream)
+        stats_failures.grant_send_messages(stats_stream)
+        stats_table.grant_read_write_data(stats_stream)
+
+        if router_mode:
+            # a single function serves every route; api/router.py dispatches
+            # each request to the handler of its (method, resource)
+            router = _lambda.Function(
+                self, 'routerFunction',
+                code=handler_code('router'),
+                handler='router.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                timeout=core.Duration.seconds(29),
+                environment={
+                    **lambda_env,
+                    **export_env,
+                    "PARALLEL_SCAN_ENABLED": str(parallel_scan).lower()
+                }
+            )
+            dynamo_table.grant_read_write_data(router)
+            functions = [router]
+
+            get_one_lambda = get_all_lambda = batch_get = router
+            create_one = batch_create = update_one = delete_one = router
+            export_start = export_status = get_stats = router
+
+            if dax_cluster is not None:
+                # the DAX readers get a router of their own: their subnets have no way
+                # to the Lambda API (export_start) or to the API itself (the stage
+                # cache invalidation of update_one / delete_one)
+                reader_router = _lambda.Function(
+                    self, 'readerRouterFunction',
+                    code=handler_code('router'),
+                    handler='router.handler',
+                    runtime=_lambda.Runtime.PYTHON_3_7,
+                    timeout=core.Duration.seconds(29),
+                    environment={
+                        **lambda_env,
+                        **reader_env,
+                        "PARALLEL_SCAN_ENABLED": str(parallel_scan).lower()
+                    },
+                    **reader_options
+                )
+                dynamo_table.grant_read_data(reader_router)
+                functions.append(reader_router)
+
+                get_one_lambda = get_all_lambda = reader_router
+
+        else:
+            get_one_lambda = _lambda.Function(
+                self, 'getOneItemFunction',
+                code=handler_code('get_one'),
+                handler='get_one.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment={ **lambda_env, **reader_env },
+                **reader_options
+            )
+
+            get_all_lambda = _lambda.Function(
+                self, 'getAllItemsFunction',
+                code=handler_code('get_all'),
+                handler='get_all.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                timeout=core.Duration.seconds(29), # same as the API Gateway integration timeout
+                environment={
+                    **lambda_env,
+                    **reader_env,
+                    "PARALLEL_SCAN_ENABLED": str(parallel_scan).lower()
+                },
+                **reader_options
+            )
+
+            batch_get = _lambda.Function(
+                self, 'batchGetItemsFunction',
+                code=handler_code('batch_get'),
+                handler='batch_get.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                timeout=core.Duration.seconds(29),
+                environment=lambda_env
+            )
+
+            create_one = _lambda.Function(
+                self, 'createItemFunction',
+                code=handler_code('create'),
+                handler='create.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment=lambda_env
+            )
+
+            batch_create = _lambda.Function(
+                self, 'batchCreateItemsFunction',
+                code=handler_code('batch_create'),
+                handler='batch_create.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                timeout=core.Duration.seconds(29),
+                environment=lambda_env
+            )
+
+            update_one = _lambda.Function(
+                self, "updateItemFunction",
+                code=handler_code('update_one'),
+                handler='update_one.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment=lambda_env
+            )
+
+            delete_one = _lambda.Function(
+                self, 'deleteItemFunction',
+                code=handler_code('delete_one'),
+                handler='delete_one.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment=lambda_env
+            )
 
-        # grant permission for this lambda function\
-        dynamo_table.grant_read_write_data(get_one_lambda)
-        dynamo_table.grant_read_write_data(get_all_lambda)
-        dynamo_table.grant_read_write_data(create_one)
-        dynamo_table.grant_read_write_data(update_one)
-        dynamo_table.grant_read_write_data(delete_one)
+            export_start = _lambda.Function(
+                self, 'exportStartFunction',
+                code=handler_code('export_start'),
+                handler='export_start.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment={ **lambda_env, **export_env }
+            )
+
+            export_status = _lambda.Function(
+                self, 'exportStatusFunction',
+                code=handler_code('export_status'),
+                handler='export_status.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment=lambda_env
+            )
+
+            get_stats = _lambda.Function(
+                self, 'getStatsFunction',
+                code=handler_code('get_stats'),
+                handler='get_stats.handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                environment=lambda_env
+            )
+
+            # grant permission for this lambda function
+            dynamo_table.grant_read_write_data(get_one_lambda)
+            dynamo_table.grant_read_write_data(get_all_lambda)
+            dynamo_table.grant_read_data(batch_get)
+            dynamo_table.grant_read_write_data(create_one)
+            dynamo_table.grant_read_write_data(batch_create)
+            dynamo_table.grant_read_write_data(update_one)
+            dynamo_table.grant_read_write_data(delete_one)
+            functions = [
+                get_one_lambda, get_all_lambda, batch_get, create_one, batch_create, update_one, delete_one,
+                export_start, export_status, get_stats
+            ]
+
+        for fn in functions + [export_worker, import_worker, stats_stream]:
+            dynamo_table.grant(fn, 'dynamodb:DescribeTable') # used by the pre-warm call
+
+        jobs_table.grant_read_write_data(export_start)
+        export_worker.grant_invoke(export_start)
+        jobs_table.grant_read_data(export_status)
+        export_bucket.grant_read(export_status) # signs the download URLs
+        stats_table.grant_read_data(get_stats)
+
+        if dax_cluster is not None:
+            for fn in dict.fromkeys([get_one_lambda, get_all_lambda]):
+                fn.add_to_role_policy(iam.PolicyStatement(
+                    actions=['dax:GetItem', 'dax:Query', 'dax:Scan'],
+                    resources=[dax_cache.attr_arn]
+                ))
+
+        # optional stage cache for the GET routes. The entries of GET /items/{id} are
+        # invalidated from the table's stream, by the function below the API
+        stage_options = {}
+        if response_cache is not None:
+            cache_settings = check_response_cache(response_cache, projection is not None)
+            stage_options['deploy_options'] = apigw.StageOptions(
+                cache_cluster_enabled=True,
+                cache_cluster_size=cache_settings['clusterSize'],
+                caching_enabled=False, # only for the methods below
+                method_options={
+                    CACHEABLE_ROUTES[route]: apigw.MethodDeploymentOptions(
+                        caching_enabled=ttl > 0,
+                        cache_ttl=core.Duration.seconds(ttl)
+                    )
+                    for (route, ttl) in cache_settings['ttlSeconds'].items()
+                }
+            )
 
         # create apigateway
         api = apigw.RestApi(
             self, 'itemsApi',
-            rest_api_name="Items Service"
+            rest_api_name="Items Service",
+            # lets the handlers send gzip/brotli compressed bodies (see api/encoding.py)
+            binary_media_types=['*/*'],
+            **stage_options
         )
 
         # create a resource
         items = api.root.add_resource('items')
 
-        get_all_integration = apigw.LambdaIntegration(get_all_lambda)
-        items.add_method('GET', get_all_integration)
+        get_all_parameters = {
+            'method.request.querystring.limit': False,
+            'method.request.querystring.cursor': False,
+            'method.request.querystring.segments': False,
+            'method.request.querystring.ids': False,
+            'method.request.querystring.index': False,
+            'method.request.querystring.key': False,
+            'method.request.querystring.order': False,
+            'method.request.querystring.sk_eq': False,
+            'method.request.querystring.sk_lt': False,
+            'method.request.querystring.sk_lte': False,
+            'method.request.querystring.sk_gt': False,
+            'method.request.querystring.sk_gte': False,
+            'method.request.querystring.sk_begins_with': False,
+            'method.request.querystring.sk_between': False,
+            'method.request.querystring.fields': False
+        }
+        # every parameter of the GET routes is part of their stage cache key
+        get_all_integration = apigw.LambdaIntegration(
+            get_all_lambda,
+            cache_key_parameters=list(get_all_parameters)
+        )
+        items.add_method('GET', get_all_integration, request_parameters=get_all_parameters)
 
         create_one_integration = apigw.LambdaIntegration(create_one)
         items.add_method('POST', create_one_integration)
 
+        batch = items.add_resource('batch')
+
+        batch_create_integration = apigw.LambdaIntegration(batch_create)
+        batch.add_method('POST', batch_create_integration)
+
+        # POST variant of GET /items?ids=..., for lists too long for a query string
+        lookup = items.add_resource('lookup')
+
+        batch_get_integration = apigw.LambdaIntegration(batch_get)
+        lookup.add_method('POST', batch_get_integration)
+
+        # aggregates kept from the table's stream, instead of counting with a full scan
+        stats_resource = items.add_resource('stats')
+
+        get_stats_integration = apigw.LambdaIntegration(get_stats)
+        stats_resource.add_method('GET', get_stats_integration)
+
+        # full-table export to S3, run in the background
+        export = items.add_resource('export')
+
+        export_start_integration = apigw.LambdaIntegration(export_start)
+        export.add_method('POST', export_start_integration)
+
+        export_job = export.add_resource('{jobId}')
+
+        export_status_integration = apigw.LambdaIntegration(export_status)
+        export_job.add_method('GET', export_status_integration)
+
         # create another resource
         single_item = items.add_resource('{id}')
 
-        get_one_integration = apigw.LambdaIntegration(get_one_lambda)
-        single_item.add_method('GET', get_one_integration)
+        get_one_parameters = {
+            'method.request.path.id': True,
+            'method.request.querystring.fields': False
+        }
+        get_one_integration = apigw.LambdaIntegration(
+            get_one_lambda,
+            cache_key_parameters=list(get_one_parameters)
+        )
+        single_item.add_method('GET', get_one_integration, request_parameters=get_one_parameters)
 
         update_one_integration = apigw.LambdaIntegration(update_one)
         single_item.add_method("PATCH", update_one_integration)
 
         delete_one_integration = apigw.LambdaIntegration(delete_one)
-        single_item.add_method('DELETE', delete_one_integration)
\ No newline at end of file
+        single_item.add_method('DELETE', delete_one_integration)
+
+        # the stage cache entries of changed items are dropped from the table's stream
+        # (see api/cache_invalidator.py), so that the writes do not wait for it
+        if response_cache is not None:
+            cache_invalidator = _lambda.Function(
+                self, 'cacheInvalidatorFunction',
+                code=handler_code('cache_invalidator'),
+                handler='cache_invalidator.handler',
+                role=invalidator_role,
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                timeout=core.Duration.seconds(60),
+                environment={ **lambda_env, "RESPONSE_CACHE_URL": api.url }
+            )
+            cache_invalidator.add_event_source_mapping(
+                'itemsStreamInvalidation',
+                event_source_arn=dynamo_table.table_stream_arn,
+                starting_position=_lambda.StartingPosition.LATEST,
+                batch_size=100
+            )
+            dynamo_table.grant_stream_read(cache_invalidator)
+            dynamo_table.grant(cache_invalidator, 'dynamodb:DescribeTable') # used by the pre-warm call
+            cache_invalidator.add_to_role_policy(iam.PolicyStatement(
+                actions=['execute-api:InvalidateCache'],
+                resources=[f"arn:{core.Aws.PARTITION}:execute-api:{self.region}:{self.account}:{api.rest_api_id}/*/GET/items/*"]
+            ))
+
+        # alarms on the per-route metrics: p99 latency above latency_alarm_ms,
+        # and any throttled DynamoDB request, over 3 consecutive 5 minute periods
+        for route in ROUTES:
+            alarm_id = route.replace(' ', '').replace('/', '-').replace('{', '').replace('}', '')
+
+            latency = cloudwatch.Metric(
+                namespace=METRICS_NAMESPACE,
+                metric_name='Latency',
+                dimensions={'Route': route},
+                statistic='p99',
+                period=core.Duration.minutes(5)
+            )
+            latency.create_alarm(
+                self, f'latencyAlarm{alarm_id}',
+                alarm_description=f"p99 latency of {route} is above {latency_alarm_ms} ms",
+                threshold=latency_alarm_ms,
+                evaluation_periods=3,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+            )
+
+            throttles = cloudwatch.Metric(
+                namespace=METRICS_NAMESPACE,
+                metric_name='Throttles',
+                dimensions={'Route': route},
+                statistic='Sum',
+                period=core.Duration.minutes(5)
+            )
+            throttles.create_alarm(
+                self, f'throttleAlarm{alarm_id}',
+                alarm_description=f"DynamoDB requests of {route} are being throttled",
+                threshold=1,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+                evaluation_periods=3,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+            )
@@ -1,8 +1,36 @@
+import json
 from aws_cdk import core
 
 from api_stack import ApiLambdaCrudDynamoDBStack
+import bundle
 
 app = core.App()
-ApiLambdaCrudDynamoDBStack(app, "ApiLambdaCrudDynamoDBExample", env={'region': 'us-east-1'})
+
+# `-c bundle=true` gives each function its own minimal, precompiled bundle
+bundle_dir = None
+if app.node.try_get_context('bundle'):
+    bundle_dir = 'build/lambda'
+    bundle.build_bundles(bundle_dir)
+
+def context_json(key):
+    # structured values come from cdk.json as JSON already, and from `-c key=...` as a string
+    value = app.node.try_get_context(key)
+    return json.loads(value) if isinstance(value, str) else value
+
+ApiLambdaCrudDynamoDBStack(
+    app, "ApiLambdaCrudDynamoDBExample",
+    parallel_scan=bool(app.node.try_get_context('parallel_scan')),
+    router_mode=bool(app.node.try_get_context('router_mode')),
+    global_secondary_indexes=context_json('global_secondary_indexes'),
+    latency_alarm_ms=int(app.node.try_get_context('latency_alarm_ms') or 1000),
+    capacity=context_json('capacity'),
+    ttl_attribute=app.node.try_get_context('ttl_attribute'),
+    dax_cluster=context_json('dax_cluster'),
+    response_cache=context_json('response_cache'),
+    stats=context_json('stats'),
+    projection=context_json('projection'),
+    bundle_dir=bundle_dir,
+    env={'region': 'us-east-1'}
+)
 
 app.synth()
\ No newline at end of file
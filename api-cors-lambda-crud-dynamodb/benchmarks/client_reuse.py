@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse, json, os, time, uuid
+
+from harness import local_dynamodb, percentile, TABLE_NAME, PRIMARY_KEY
+
+# Per-invocation overhead of building the DynamoDB client inside the handler
+# (what every handler used to do) versus reusing the container-wide client
+# from api/db.py. Both modes run the same get_item call.
+
+
+def per_invocation(item_id):
+    import boto3
+    ddb = boto3.resource('dynamodb', endpoint_url=os.environ['DDB_ENDPOINT_URL'])
+    table = ddb.Table(TABLE_NAME)
+    return table.get_item(Key={ PRIMARY_KEY: item_id })
+
+
+def shared_client(item_id):
+    import db
+    table = db.get_table(TABLE_NAME)
+    return table.get_item(Key={ PRIMARY_KEY: item_id })
+
+
+def measure(func, item_ids):
+    samples = []
+    for item_id in item_ids:
+        start = time.perf_counter()
+        func(item_id)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def summarize(samples):
+    return {
+        "first_ms": samples[0],
+        "mean_ms": sum(samples) / len(samples),
+        "p50_ms": percentile(samples, 50),
+        "p99_ms": percentile(samples, 99)
+    }
+
+
+def main(iterations, output):
+    with local_dynamodb() as client:
+        item_ids = [uuid.uuid4().hex for _ in range(iterations)]
+        for item_id in item_ids:
+            client.put_item(TableName=TABLE_NAME, Item={ PRIMARY_KEY: {'S': item_id} })
+
+        results = {
+            "iterations": iterations,
+            "endpoint": os.environ['DDB_ENDPOINT_URL'],
+            "per_invocation_client": summarize(measure(per_invocation, item_ids)),
+            "shared_client": summarize(measure(shared_client, item_ids))
+        }
+
+    before = results["per_invocation_client"]["mean_ms"]
+    after = results["shared_client"]["mean_ms"]
+    results["saved_per_invocation_ms"] = before - after
+
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', type=str, default=None, help="also write the results to this JSON file")
+
+    args = parser.parse_args()
+    main(args.iterations, args.output)
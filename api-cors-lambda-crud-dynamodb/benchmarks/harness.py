@@ -0,0 +1,109 @@
+import contextlib, json, logging, os, socket, sys
+
+# Local DynamoDB stand-in shared by the benchmarks.
+#
+# If DDB_ENDPOINT_URL is set, the benchmarks talk to that endpoint, e.g. DynamoDB Local:
+#   docker run -p 8000:8000 amazon/dynamodb-local
+#   export DDB_ENDPOINT_URL=http://localhost:8000
+# Otherwise they start moto's DynamoDB mock as a local server. A real HTTP
+# endpoint (rather than moto's in-process patching) keeps the client's
+# connection handling in the picture and can be shared by worker processes.
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+TABLE_NAME = 'items'
+PRIMARY_KEY = 'itemID'
+
+
+def setup_env():
+    # dummy credentials are fine for both moto and DynamoDB Local
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ['TABLE_NAME'] = TABLE_NAME
+    os.environ['PRIMARY_KEY'] = PRIMARY_KEY
+
+    # handlers are imported the same way Lambda does, from the root of api/
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+
+
+def _start_moto_server():
+    from moto.server import ThreadedMotoServer
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # one access log line per request otherwise
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+@contextlib.contextmanager
+def local_dynamodb():
+    """
+    Create an empty `items` table on the local stand-in and yield a low-level
+    client for it. The table is dropped again on exit.
+    """
+    setup_env()
+    import boto3
+
+    server = None
+    if not os.environ.get('DDB_ENDPOINT_URL', None):
+        server, endpoint_url = _start_moto_server()
+        # picked up by api/db.py, here and in any worker process
+        os.environ['DDB_ENDPOINT_URL'] = endpoint_url
+    endpoint_url = os.environ['DDB_ENDPOINT_URL']
+
+    client = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    if TABLE_NAME in client.list_tables()['TableNames']:
+        client.delete_table(TableName=TABLE_NAME)
+    client.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': PRIMARY_KEY, 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': PRIMARY_KEY, 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    client.get_waiter('table_exists').wait(TableName=TABLE_NAME)
+
+    try:
+        yield client
+    finally:
+        client.delete_table(TableName=TABLE_NAME)
+        if server is not None:
+            server.stop()
+            del os.environ['DDB_ENDPOINT_URL']
+
+
+def api_event(method, resource, body=None, path_parameters=None, query=None, headers=None):
+    """
+    A minimal API Gateway (Lambda proxy integration) event.
+    """
+    path = resource
+    for (name, value) in (path_parameters or {}).items():
+        path = path.replace('{' + name + '}', value)
+
+    return {
+        "httpMethod": method,
+        "resource": resource,
+        "path": path,
+        "headers": headers or {},
+        "queryStringParameters": query,
+        "pathParameters": path_parameters,
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+        "requestContext": {
+            "stage": "local",
+            "domainName": "localhost"
+        }
+    }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
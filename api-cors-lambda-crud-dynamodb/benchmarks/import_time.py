@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import argparse, json, os, statistics, subprocess, sys
+
+from harness import API_DIR, TABLE_NAME, PRIMARY_KEY
+
+# Cold-start import cost of each handler, from `python -X importtime`.
+#
+# Every handler is imported in a fresh interpreter, the way a new Lambda
+# container does, from api/ or from the bundles built by ../bundle.py.
+# Each import is repeated and the median per module is reported, so that
+# one noisy run does not decide. With --baseline, the report is compared
+# with an earlier one and the run fails when a handler got slower by more
+# than --max-regression percent.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bundle import HANDLERS
+
+
+def import_once(handler, code_dir):
+    """
+    Import `handler` in a new interpreter. Returns {module: (self_us, cumulative_us, depth)}
+    for the handler and everything its import pulled in (not the interpreter's own startup).
+    """
+    env = dict(
+        os.environ,
+        AWS_ACCESS_KEY_ID='local', AWS_SECRET_ACCESS_KEY='local', AWS_DEFAULT_REGION='us-east-1',
+        TABLE_NAME=TABLE_NAME, PRIMARY_KEY=PRIMARY_KEY,
+        DDB_PREWARM='false' # measure the imports, not the connection
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {handler}'],
+        cwd=code_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True
+    )
+
+    # "import time:  <self us> | <cumulative us> | <name>", where the name is
+    # indented by two spaces per nesting level, and a module is listed after
+    # the modules it imported
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        (self_us, cumulative_us, name) = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    end = max(i for (i, entry) in enumerate(entries) if entry[0] == handler and entry[3] == 0)
+    start = end
+    while start > 0 and entries[start - 1][3] > 0:
+        start -= 1
+    return {
+        name: (self_us, cumulative_us, depth)
+        for (name, self_us, cumulative_us, depth) in entries[start:end + 1]
+    }
+
+
+def profile(handler, code_dir, repeat, top):
+    runs = [ import_once(handler, code_dir) for _ in range(repeat) ]
+
+    def median(module, field):
+        return statistics.median(run[module][field] for run in runs if module in run)
+
+    modules = {
+        module: {"self_us": median(module, 0), "cumulative_us": median(module, 1), "depth": entry[2]}
+        for (module, entry) in runs[0].items()
+    }
+    slowest = sorted(modules, key=lambda module: modules[module]["self_us"], reverse=True)[:top]
+
+    return {
+        "total_ms": modules[handler]["cumulative_us"] / 1000.0,
+        "modules": len(modules),
+        # the handler's direct imports, with everything they pull in
+        "direct_imports_ms": {
+            module: modules[module]["cumulative_us"] / 1000.0
+            for module in modules if modules[module]["depth"] == 1
+        },
+        "slowest_modules_ms": { module: modules[module]["self_us"] / 1000.0 for module in slowest }
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print the change of each handler's total against `baseline`. Returns
+    the handlers that regressed by more than max_regression percent.
+    """
+    regressed = []
+    for (handler, result) in results.items():
+        before = baseline.get("handlers", {}).get(handler, None)
+        if before is None:
+            continue
+        change = (result["total_ms"] - before["total_ms"]) / before["total_ms"] * 100.0
+        print(f"{handler:12} {before['total_ms']:8.1f} ms -> {result['total_ms']:8.1f} ms ({change:+.1f}%)")
+        if change > max_regression:
+            regressed.append(handler)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the import time of each Lambda handler.")
+    parser.add_argument('handlers', nargs='*', default=list(HANDLERS))
+    parser.add_argument('--bundles', default=None,
+                        help="directory of bundles built by bundle.py (default: import from api/)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="number of slowest modules to list")
+    parser.add_argument('--baseline', default=None, help="earlier --output file to compare with")
+    parser.add_argument('--max-regression', type=float, default=10.0, help="percent (default: 10)")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results = {}
+    for handler in args.handlers:
+        code_dir = os.path.join(args.bundles, handler) if args.bundles else API_DIR
+        results[handler] = profile(handler, os.path.abspath(code_dir), args.repeat, args.top)
+
+    report = {"python": sys.version.split()[0], "repeat": args.repeat, "handlers": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressed = compare(results, json.load(fp), args.max_regression)
+        if regressed:
+            print(f"import time regressed by more than {args.max_regression}%: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import argparse, json, multiprocessing, os, random, sys, time, uuid
+
+from harness import local_dynamodb, api_event, percentile, setup_env, TABLE_NAME, PRIMARY_KEY
+
+# Load test for the CRUD handlers.
+#
+# The handlers are invoked in-process with synthetic API Gateway events.
+# Each worker process plays the part of one Lambda container: it imports the
+# handlers once and serves one request at a time. The capacity units each
+# endpoint consumed come from the handlers' own metrics (api/metrics.py):
+# api/db.py hooks every DynamoDB client, which makes each call with
+# ReturnConsumedCapacity=TOTAL, and the recorder holds the figures of the
+# last invocation.
+#
+# Note that moto only approximates consumed capacity; use DynamoDB Local
+# (see harness.py) for figures that follow item size.
+
+ENDPOINTS = ('create', 'get_one', 'get_all', 'update_one', 'delete_one')
+
+
+def parse_mix(text, cast):
+    """
+    Parse "a:1,b:2" into [(cast(a), 1.0), (cast(b), 2.0)].
+    """
+    mix = []
+    for part in text.split(','):
+        (key, weight) = part.split(':')
+        mix.append((cast(key.strip()), float(weight)))
+    return mix
+
+
+def pick(rng, mix):
+    keys = [ key for (key, _) in mix ]
+    weights = [ weight for (_, weight) in mix ]
+    return rng.choices(keys, weights=weights)[0]
+
+
+def make_item(rng, size):
+    # an attribute of roughly `size` bytes, plus a few small ones
+    return {
+        "name": f"item-{rng.randrange(1000000)}",
+        "category": rng.choice(["books", "music", "games"]),
+        "payload": "x" * max(0, size - 64)
+    }
+
+
+def worker(worker_id, config, item_ids, queue):
+    setup_env()
+    os.environ['METRICS_ENABLED'] = 'true' # the capacity figures come from the metric hooks
+    # the handlers log a line per request; keep the report readable
+    sys.stdout = open(os.devnull, 'w')
+
+    import metrics
+    import create, get_one, get_all, update_one, delete_one
+    handlers = {
+        "create": create.handler,
+        "get_one": get_one.handler,
+        "get_all": get_all.handler,
+        "update_one": update_one.handler,
+        "delete_one": delete_one.handler
+    }
+
+    rng = random.Random(config["seed"] + worker_id)
+    endpoint_mix = parse_mix(config["endpoint_mix"], str)
+    size_mix = parse_mix(config["size_mix"], int)
+
+    samples = []
+    started = time.perf_counter()
+    deadline = started + config["duration"]
+    while time.perf_counter() < deadline:
+        endpoint = pick(rng, endpoint_mix)
+        if endpoint in ('get_one', 'update_one', 'delete_one') and not item_ids:
+            endpoint = 'create'
+
+        if endpoint == 'create':
+            event = api_event('POST', '/items', body=make_item(rng, pick(rng, size_mix)))
+        elif endpoint == 'get_all':
+            event = api_event('GET', '/items', query={"limit": str(config["page_size"])})
+        else:
+            item_id = rng.choice(item_ids)
+            path_parameters = {"id": item_id}
+            if endpoint == 'get_one':
+                event = api_event('GET', '/items/{id}', path_parameters=path_parameters)
+            elif endpoint == 'update_one':
+                event = api_event(
+                    'PATCH', '/items/{id}', path_parameters=path_parameters,
+                    body={"$set": {"name": f"item-{rng.randrange(1000000)}"}, "$add": {"views": 1}}
+                )
+            else:
+                event = api_event('DELETE', '/items/{id}', path_parameters=path_parameters)
+                item_ids.remove(item_id)
+
+        # the handlers are metrics.instrumented, which resets the recorder on every invocation
+        start = time.perf_counter()
+        response = handlers[endpoint](event, None)
+        latency_ms = (time.perf_counter() - start) * 1000.0
+
+        values = metrics.recorder.values
+        samples.append((endpoint, latency_ms, response["statusCode"], values["ReadCapacityUnits"], values["WriteCapacityUnits"]))
+
+    queue.put((samples, time.perf_counter() - started))
+
+
+def seed_table(client, count, size_mix, rng):
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+
+    item_ids = []
+    for _ in range(count):
+        item = make_item(rng, pick(rng, size_mix))
+        item[PRIMARY_KEY] = uuid.uuid4().hex
+        item["version"] = 1
+        client.put_item(
+            TableName=TABLE_NAME,
+            Item={ k: serializer.serialize(v) for (k, v) in item.items() }
+        )
+        item_ids.append(item[PRIMARY_KEY])
+    return item_ids
+
+
+def summarize(samples, elapsed):
+    report = {}
+    for endpoint in ENDPOINTS:
+        rows = [ row for row in samples if row[0] == endpoint ]
+        if not rows:
+            continue
+
+        latencies = [ row[1] for row in rows ]
+        read_units = sum(row[3] for row in rows)
+        write_units = sum(row[4] for row in rows)
+        report[endpoint] = {
+            "requests": len(rows),
+            "errors": sum(1 for row in rows if row[2] >= 500),
+            "throughput_rps": len(rows) / elapsed,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99)
+            },
+            "read_units": read_units,
+            "write_units": write_units,
+            "read_units_per_request": read_units / len(rows),
+            "write_units_per_request": write_units / len(rows)
+        }
+    return report
+
+
+def main(config):
+    rng = random.Random(config["seed"])
+    size_mix = parse_mix(config["size_mix"], int)
+    stand_in = "dynamodb-local" if os.environ.get('DDB_ENDPOINT_URL', None) else "moto"
+
+    with local_dynamodb() as client:
+        item_ids = seed_table(client, config["seed_items"], size_mix, rng)
+
+        # each worker updates and deletes its own share of the seeded items
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        workers = [
+            context.Process(
+                target=worker,
+                args=(worker_id, config, item_ids[worker_id::config["concurrency"]], queue)
+            )
+            for worker_id in range(config["concurrency"])
+        ]
+
+        for process in workers:
+            process.start()
+        # throughput is measured over the time the workers spent serving
+        # requests, leaving out process start-up and handler imports
+        samples = []
+        elapsed = 0.0
+        for _ in workers:
+            (worker_samples, worker_elapsed) = queue.get()
+            samples.extend(worker_samples)
+            elapsed = max(elapsed, worker_elapsed)
+        for process in workers:
+            process.join()
+
+    results = {
+        "config": config,
+        "stand_in": stand_in,
+        "elapsed_seconds": elapsed,
+        "total_requests": len(samples),
+        "throughput_rps": len(samples) / elapsed,
+        "endpoints": summarize(samples, elapsed)
+    }
+
+    print(json.dumps(results, indent=2))
+    if config["output"]:
+        with open(config["output"], 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=4, help="number of worker processes")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds each worker runs for")
+    parser.add_argument('--endpoint-mix', type=str, default="create:20,get_one:50,get_all:5,update_one:20,delete_one:5",
+                        help="relative weight of each endpoint")
+    parser.add_argument('--size-mix', type=str, default="1024:80,10240:15,102400:5",
+                        help="item sizes in bytes and their relative weights")
+    parser.add_argument('--seed-items', type=int, default=500, help="items written before the test starts")
+    parser.add_argument('--page-size', type=int, default=50, help="limit used for get_all")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, for repeatable runs")
+    parser.add_argument('--output', type=str, default=None, help="also write the results to this JSON file")
+
+    args = parser.parse_args()
+    main(vars(args))
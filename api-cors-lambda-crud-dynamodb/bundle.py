@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import argparse, ast, importlib.util, os, py_compile, shutil, sys
+
+# Per-handler Lambda bundles.
+#
+# Instead of shipping the whole api/ directory with every function, each
+# handler gets a directory with only the modules it imports (followed
+# transitively), plus any third-party package vendored into api/ that it
+# imports (e.g. orjson, brotli, amazondax). The router imports its handlers
+# with importlib, so the modules named in its ROUTES table count as imports.
+#
+# Modules are precompiled into __pycache__ with UNCHECKED_HASH pycs: the
+# Lambda file system is read-only, so without them every cold start compiles
+# the sources again in memory. A pyc is only used by the Python version that
+# wrote it, so bundles built with another version than the Lambda runtime
+# are left uncompiled (with a warning).
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+RUNTIME_VERSION = (3, 7) # _lambda.Runtime.PYTHON_3_7 in api_stack.py
+
+HANDLERS = (
+    'router', 'get_one', 'get_all', 'batch_get', 'create', 'batch_create', 'update_one', 'delete_one',
+    'get_stats', 'export_start', 'export_status', 'export_worker', 'import_worker', 'stats_stream',
+    'cache_invalidator'
+)
+
+
+def imported_names(path):
+    """
+    The top-level names of all the modules a source file imports, including
+    imports inside functions (the lazy ones) and the modules of a ROUTES table.
+    """
+    with open(path) as fp:
+        tree = ast.parse(fp.read(), path)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+        elif isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == 'ROUTES' for target in node.targets):
+            routes = ast.literal_eval(node.value)
+            names.update(target.rsplit('.', 1)[0] for target in routes.values())
+    return names
+
+
+def vendored_files(name, api_dir):
+    """
+    The files of a third-party package vendored into api/: its package
+    directory or extension module, and its .dist-info.
+    """
+    found = []
+    for entry in os.listdir(api_dir):
+        if entry == name or (entry.startswith(name + '.') and entry.endswith(('.so', '.pyd'))):
+            found.append(entry)
+        elif entry.startswith(name + '-') and entry.endswith('.dist-info'):
+            found.append(entry)
+    return found
+
+
+def dependencies(handler, api_dir=API_DIR):
+    """
+    (modules, vendored): the api/ modules `handler` needs, and the vendored
+    files it needs from api/. The imports of vendored packages are followed
+    too, so that their own dependencies come along.
+    """
+    modules = set()
+    vendored = set()
+    pending = [handler]
+
+    while pending:
+        name = pending.pop()
+        if name in modules:
+            continue
+        modules.add(name)
+
+        sources = [ os.path.join(api_dir, name + '.py') ]
+        if not os.path.isfile(sources[0]):
+            entries = vendored_files(name, api_dir)
+            vendored.update(entries)
+            sources = [
+                os.path.join(d, f)
+                for entry in entries if os.path.isdir(os.path.join(api_dir, entry))
+                for (d, _, fs) in os.walk(os.path.join(api_dir, entry)) for f in fs if f.endswith('.py')
+            ]
+
+        for source in sources:
+            for imported in imported_names(source):
+                # standard library and runtime packages (boto3) are simply not found in api/
+                if os.path.isfile(os.path.join(api_dir, imported + '.py')) or vendored_files(imported, api_dir):
+                    pending.append(imported)
+
+    modules = [ name for name in modules if os.path.isfile(os.path.join(api_dir, name + '.py')) ]
+    return sorted(modules), sorted(vendored)
+
+
+def compile_tree(root):
+    """
+    Precompile every source under `root` into __pycache__. Returns the number of pycs.
+    """
+    compiled = 0
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames[:] = [ d for d in dirnames if d != '__pycache__' ]
+        for filename in filenames:
+            if filename.endswith('.py'):
+                source = os.path.join(dirpath, filename)
+                py_compile.compile(
+                    source,
+                    cfile=importlib.util.cache_from_source(source),
+                    doraise=True,
+                    invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+                )
+                compiled += 1
+    return compiled
+
+
+def build_bundle(handler, out_dir, api_dir=API_DIR):
+    """
+    Build the bundle of `handler` in out_dir/<handler>. Returns its directory.
+    """
+    target = os.path.join(out_dir, handler)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.makedirs(target)
+
+    (modules, vendored) = dependencies(handler, api_dir)
+    for module in modules:
+        shutil.copy2(os.path.join(api_dir, module + '.py'), target)
+    for entry in vendored:
+        source = os.path.join(api_dir, entry)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(target, entry), ignore=shutil.ignore_patterns('__pycache__'))
+        else:
+            shutil.copy2(source, target)
+
+    if sys.version_info[:2] == RUNTIME_VERSION:
+        compile_tree(target)
+
+    return target
+
+
+def build_bundles(out_dir, handlers=HANDLERS, api_dir=API_DIR):
+    if sys.version_info[:2] != RUNTIME_VERSION:
+        print(
+            f"bundle.py: Python {sys.version_info[0]}.{sys.version_info[1]} cannot precompile for the "
+            f"Python {RUNTIME_VERSION[0]}.{RUNTIME_VERSION[1]} runtime, bundles are left uncompiled",
+            file=sys.stderr
+        )
+    return { handler: build_bundle(handler, out_dir, api_dir) for handler in handlers }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build one minimal Lambda bundle per handler.")
+    parser.add_argument('handlers', nargs='*', default=list(HANDLERS))
+    parser.add_argument('--out', default='build/lambda', help="output directory (default: build/lambda)")
+    args = parser.parse_args()
+
+    for (handler, target) in build_bundles(args.out, args.handlers).items():
+        files = [ os.path.join(d, f) for (d, _, fs) in os.walk(target) for f in fs ]
+        size = sum(os.path.getsize(f) for f in files)
+        print(f"{handler:12} {len(files):4} files {size / 1024:8.1f} KB  {target}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
+import json
 import os
 from aws_cdk import core
 
 from my_stack import MyStack
 
 app = core.App()
+
+# e.g. -c thumbnails='{"interval": 10, "sprite": true}'
+thumbnails = app.node.try_get_context('thumbnails')
+if isinstance(thumbnails, str):
+    thumbnails = json.loads(thumbnails)
+
 MyStack(
     app, "s3-lambda-ecs",
+    # `-c queue_mode=true` queues the uploads for an autoscaled worker service
+    queue_mode=bool(app.node.try_get_context('queue_mode')),
+    max_workers=int(app.node.try_get_context('max_workers') or 10),
+    thumbnails=thumbnails,
+    # `-c ffmpeg_layer_arn=<ARN>` sends videos up to fast_path_max_mb to a Lambda function
+    ffmpeg_layer_arn=app.node.try_get_context('ffmpeg_layer_arn'),
+    fast_path_max_mb=int(app.node.try_get_context('fast_path_max_mb') or 50),
+    dedup_ttl_days=int(app.node.try_get_context('dedup_ttl_days') or 30),
     env={
         "region": "us-east-1",
         "account": os.environ["CDK_DEFAULT_ACCOUNT"], 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import argparse, json, os, shutil, statistics, subprocess, sys, tempfile, threading, time, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bytes transferred and time-to-thumbnail for one video, by the way ffmpeg
+# gets at it.
+#
+# The video is served from a local HTTP server that speaks range requests,
+# like S3 behind a presigned URL, and counts the requests and bytes it
+# sends. --latency-ms adds a delay before each response, for S3's time to
+# first byte. The modes are:
+#   download     fetch the whole file, then take the frame from the local copy
+#   output-seek  ffmpeg -i <url> -ss <position>: what the public image did
+#   range        the worker (docker/thumbnail.py): -ss before -i, range requests
+# and, with --positions, the worker's two ways to take several frames:
+#   seek-frames     one seek per position
+#   extract-frames  one pass over the whole video
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docker'))
+import thumbnail
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def add(self, sent):
+        with self.lock:
+            self.requests += 1
+            self.bytes += sent
+
+
+def make_server(path, counter, latency):
+
+    size = os.path.getsize(path)
+
+    class RangeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, as S3
+
+        def do_GET(self):
+            time.sleep(latency)
+            start, end = 0, size - 1
+            header = self.headers.get('Range', None)
+            if header and header.startswith('bytes='):
+                (first, _, last) = header[len('bytes='):].split(',')[0].partition('-')
+                start = int(first) if first else size - int(last)
+                end = int(last) if first and last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                counter.add(0)
+                return
+
+            end = min(end, size - 1)
+            self.send_response(206 if header else 200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(end - start + 1))
+            if header:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+
+            # ffmpeg drops the connection once it has read enough: count what was actually sent
+            sent = 0
+            with open(path, 'rb') as fp:
+                fp.seek(start)
+                remaining = end - start + 1
+                try:
+                    while remaining > 0:
+                        chunk = fp.read(min(65536, remaining))
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        remaining -= len(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+            counter.add(sent)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+
+
+def download(url, workdir, position):
+    local = os.path.join(workdir, 'video')
+    with urllib.request.urlopen(url) as response, open(local, 'wb') as fp:
+        shutil.copyfileobj(response, fp)
+    thumbnail.make_thumbnail(local, os.path.join(workdir, 'thumbnail.png'), position)
+
+
+def output_seek(url, workdir, position):
+    subprocess.run(
+        [
+            'ffmpeg', '-loglevel', 'error', '-y', '-i', url, '-ss', str(position),
+            '-frames:v', '1', '-vcodec', 'png', '-an', os.path.join(workdir, 'thumbnail.png')
+        ],
+        check=True
+    )
+
+
+def range_seek(url, workdir, position):
+    thumbnail.make_thumbnail(url, os.path.join(workdir, 'thumbnail.png'), position)
+
+
+def run(mode, url, counter, repeat):
+    seconds = []
+    for _ in range(repeat):
+        counter.reset()
+        with tempfile.TemporaryDirectory() as workdir:
+            started = time.perf_counter()
+            mode(url, workdir)
+            seconds.append(time.perf_counter() - started)
+        time.sleep(0.1) # let the server count the responses ffmpeg cut short
+    return {
+        "requests": counter.requests,
+        "mb_transferred": round(counter.bytes / 1024 / 1024, 2),
+        "seconds_median": round(statistics.median(seconds), 3),
+        "seconds": [ round(s, 3) for s in seconds ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes read and time to thumbnail, by input mode.")
+    parser.add_argument('video', help="a local video file, preferably a large one")
+    parser.add_argument('--position', type=float, default=2.0, help="seconds (default: 2)")
+    parser.add_argument('--positions', default=None, help="comma separated seconds, for the several-frames modes")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="delay before each response (default: 20)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    counter = Counter()
+    server = make_server(args.video, counter, args.latency_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(args.video)}"
+
+    position = args.position
+    modes = {
+        'download': lambda url, workdir: download(url, workdir, position),
+        'output-seek': lambda url, workdir: output_seek(url, workdir, position),
+        'range': lambda url, workdir: range_seek(url, workdir, position)
+    }
+    if args.positions:
+        positions = [ float(p) for p in args.positions.split(',') ]
+        modes['seek-frames'] = lambda url, workdir: thumbnail.seek_frames(url, positions, workdir)
+        modes['extract-frames'] = lambda url, workdir: thumbnail.extract_frames(
+            url, {"positions": positions, "maxFrames": len(positions)}, workdir
+        )
+
+    report = {
+        "video": os.path.basename(args.video),
+        "mb": round(os.path.getsize(args.video) / 1024 / 1024, 2),
+        "latency_ms": args.latency_ms,
+        "modes": { name: run(mode, url, counter, args.repeat) for (name, mode) in modes.items() }
+    }
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
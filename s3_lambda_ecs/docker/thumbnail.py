@@ -0,0 +1,365 @@
+import json
+import math
+import os
+import re
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import boto3
+from botocore.config import Config
+
+# Thumbnail worker run by the ECS tasks.
+#
+# A video is described by a job
+#   {"bucket": ..., "key": ..., "name": <output name>, "frames": <frames>}
+# where frames (see lambda/lambda_funcs.py) is one of
+#   {"positions": [2.0, 10.0]}  frames at these times (seconds)
+#   {"interval": 10}            a frame every 10 seconds
+#   {"scene": 0.4}              the first frame, and every scene change
+# with an optional "sprite": {"columns": 5, "width": 160} and "maxFrames".
+#
+# A single position without a sprite makes s3://<OUTPUT_S3_PATH>/<name>.png,
+# as before. Anything else uploads the frames, the sprite sheet and a WebVTT
+# index of them under <name>/.
+#
+# ffmpeg reads the video through a short-lived presigned URL, with HTTP
+# range requests: seeking before the input (-ss before -i) makes it fetch
+# the index (moov atom) and the bytes around each position only. A few
+# positions are each read that way; intervals, scene changes and long lists
+# of positions decode the whole video once instead.
+#
+# The same code runs in the Lambda path for small videos (lambda_handler(),
+# with ffmpeg from a layer and /tmp as its scratch space).
+#
+# A task started for a few videos gets their jobs as a JSON list in
+# THUMBNAIL_JOBS, and exits with 1 if any of them failed. A worker of the
+# queue mode service (THUMBNAIL_QUEUE_URL) takes jobs from the queue, one
+# at a time, until ECS stops it. While a video is processed, its message is
+# kept invisible to the other workers by extending its visibility timeout
+# every minute, for MAX_JOB_SECONDS at most. A message is deleted as soon as
+# its video is done; the others come back after the visibility timeout, and
+# end up in the dead-letter queue once they failed too many times.
+
+OUTPUT_S3_PATH = os.environ.get("OUTPUT_S3_PATH", "")
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
+THUMBNAIL_QUEUE_URL = os.environ.get("THUMBNAIL_QUEUE_URL", "")
+# where the thumbnails made are recorded, so that the same video is not processed again
+THUMBNAIL_INDEX_TABLE = os.environ.get("THUMBNAIL_INDEX_TABLE", "")
+THUMBNAIL_INDEX_TTL_DAYS = int(os.environ.get("THUMBNAIL_INDEX_TTL_DAYS", "30"))
+PRESIGNED_URL_SECONDS = int(os.environ.get("PRESIGNED_URL_SECONDS", "900"))
+# up to this many positions are read by seeking to each, rather than by decoding the whole video
+MAX_SEEK_POSITIONS = int(os.environ.get("MAX_SEEK_POSITIONS", "10"))
+# the queue's visibility timeout, which the worker renews every VISIBILITY_HEARTBEAT_SECONDS
+QUEUE_VISIBILITY_SECONDS = int(os.environ.get("QUEUE_VISIBILITY_SECONDS", "300"))
+VISIBILITY_HEARTBEAT_SECONDS = int(os.environ.get("VISIBILITY_HEARTBEAT_SECONDS", "60"))
+# a video taking longer than this is given up on: its message comes back to the queue
+MAX_JOB_SECONDS = int(os.environ.get("MAX_JOB_SECONDS", "7200"))
+
+FRAME_PATTERN = 'frame-%04d.png'
+# what ffmpeg logs: the duration of the input, and the time of each frame (showinfo)
+DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+FRAME_TIME = re.compile(r'pts_time:\s*(-?\d+(?:\.\d+)?)')
+
+def input_args(video_url, position=None):
+    """
+    ffmpeg options to read the video, from `position` (seconds) if given.
+    """
+    args = []
+    if video_url.startswith(('http://', 'https://')):
+        # range requests on one keep-alive connection, rather than a new one per seek
+        args += [ '-seekable', '1', '-multiple_requests', '1' ]
+    if position is not None:
+        # -ss before -i seeks in the input, so ffmpeg neither reads nor decodes everything up to the position
+        args += [ '-ss', str(position) ]
+    return args + [ '-i', video_url ]
+
+def parse_duration(log, default):
+    duration = DURATION.search(log)
+    if duration is None:
+        return default
+    return int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+
+def png_size(path):
+    # width and height, from the IHDR chunk that starts every PNG
+    with open(path, 'rb') as fp:
+        return struct.unpack('>II', fp.read(24)[16:24])
+
+def make_thumbnail(video_url, thumbnail_path, position):
+    subprocess.run(
+        [
+            'ffmpeg', '-loglevel', 'error', '-y',
+            *input_args(video_url, position),
+            '-frames:v', '1', '-vcodec', 'png', '-an',
+            thumbnail_path
+        ],
+        check=True
+    )
+
+def seek_frames(video_url, positions, workdir):
+    """
+    Write the frame at each position, in a single ffmpeg run that opens the
+    video once per position and seeks there. Returns (frame paths, their
+    times, the video's duration).
+    """
+    args = [ 'ffmpeg', '-hide_banner', '-y' ]
+    for position in positions:
+        args += input_args(video_url, position)
+    for (i, position) in enumerate(positions):
+        args += [ '-map', f'{i}:v:0', '-frames:v', '1', '-an', os.path.join(workdir, f'seek-{i:04d}.png') ]
+    result = subprocess.run(args, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # positions past the end of the video give no frame; number the others without gaps
+    paths = []
+    times = []
+    for (i, position) in enumerate(positions):
+        path = os.path.join(workdir, f'seek-{i:04d}.png')
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            paths.append(os.path.join(workdir, FRAME_PATTERN % (len(paths) + 1)))
+            os.rename(path, paths[-1])
+            times.append(position)
+    if not paths:
+        raise ValueError("no frame was selected")
+    return paths, times, parse_duration(result.stderr, times[-1] + 1.0)
+
+def select_expression(frames):
+    # the ffmpeg select filter keeps the frames for which this is not 0
+    if 'positions' in frames:
+        # the first frame at or after each position
+        return '+'.join(
+            f"gte(t,{position})*(isnan(prev_pts)+lt(prev_pts*TB,{position}))" for position in frames['positions']
+        )
+    if 'interval' in frames:
+        return f"isnan(prev_selected_t)+gte(t-prev_selected_t,{frames['interval']})"
+    return f"eq(n,0)+gt(scene,{frames['scene']})"
+
+def extract_frames(video_url, frames, workdir):
+    """
+    Decode the video once, and write the frames that `frames` selects.
+    Returns (frame paths, their times, the video's duration).
+    """
+    result = subprocess.run(
+        [
+            'ffmpeg', '-hide_banner', '-y', *input_args(video_url), '-an',
+            '-vf', f"select='{select_expression(frames)}',showinfo",
+            '-vsync', 'vfr',
+            '-frames:v', str(frames.get('maxFrames', 100)),
+            os.path.join(workdir, FRAME_PATTERN)
+        ],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+
+    paths = []
+    while os.path.exists(os.path.join(workdir, FRAME_PATTERN % (len(paths) + 1))):
+        paths.append(os.path.join(workdir, FRAME_PATTERN % (len(paths) + 1)))
+    if not paths:
+        raise ValueError("no frame was selected")
+
+    times = [ float(t) for t in FRAME_TIME.findall(result.stderr) ][:len(paths)]
+    return paths, times, parse_duration(result.stderr, times[-1] + 1.0)
+
+def make_sprite(paths, workdir, sprite):
+    """
+    Tile the frames into one image. Returns its path and the size of a tile.
+    This reads the small PNGs that were extracted, not the video.
+    """
+    columns = min(sprite['columns'], len(paths))
+    rows = math.ceil(len(paths) / columns)
+    width = sprite['width']
+    (frame_width, frame_height) = png_size(paths[0])
+    height = max(2, round(frame_height * width / frame_width / 2) * 2)
+
+    sprite_path = os.path.join(workdir, 'sprite.png')
+    subprocess.run(
+        [
+            'ffmpeg', '-loglevel', 'error', '-y',
+            '-i', os.path.join(workdir, FRAME_PATTERN),
+            '-vf', f"scale={width}:{height},tile={columns}x{rows}",
+            '-frames:v', '1',
+            sprite_path
+        ],
+        check=True
+    )
+    return sprite_path, (width, height), columns
+
+def vtt_time(seconds):
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+def make_vtt(times, duration, targets):
+    """
+    WebVTT index of the frames: each frame covers the time up to the next
+    one, and points to its image (or its tile in the sprite).
+    """
+    cues = [ 'WEBVTT', '' ]
+    for (i, target) in enumerate(targets):
+        start = times[i] if i > 0 else 0.0
+        end = times[i + 1] if i + 1 < len(times) else max(duration, start + 1.0)
+        cues += [ f"{vtt_time(start)} --> {vtt_time(end)}", target, '' ]
+    return "\n".join(cues)
+
+def output_key(output):
+    bucket, _, prefix = OUTPUT_S3_PATH.partition('/')
+    return bucket, f"{prefix}/{output}" if prefix else output
+
+def upload(s3, path, output, content_type='image/png'):
+    bucket, key = output_key(output)
+    s3.upload_file(path, bucket, key, ExtraArgs={'ContentType': content_type})
+    return output
+
+def process(s3, job):
+    """
+    Make and upload the thumbnails of a job. Returns their output names.
+    """
+    frames = job['frames']
+    name = job['name']
+    video_url = s3.generate_presigned_url(
+        'get_object', Params={ 'Bucket': job['bucket'], 'Key': job['key'] }, ExpiresIn=PRESIGNED_URL_SECONDS
+    )
+    positions = frames.get('positions', [])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if len(positions) == 1 and not frames.get('sprite', None):
+            thumbnail_path = os.path.join(workdir, 'thumbnail.png')
+            make_thumbnail(video_url, thumbnail_path, positions[0])
+            return [ upload(s3, thumbnail_path, name + '.png') ]
+
+        if 1 <= len(positions) <= MAX_SEEK_POSITIONS:
+            (paths, times, duration) = seek_frames(video_url, positions[:frames.get('maxFrames', 100)], workdir)
+        else:
+            (paths, times, duration) = extract_frames(video_url, frames, workdir)
+        outputs = [ upload(s3, path, f"{name}/{os.path.basename(path)}") for path in paths ]
+        targets = [ os.path.basename(path) for path in paths ]
+
+        if frames.get('sprite', None):
+            (sprite_path, (width, height), columns) = make_sprite(paths, workdir, frames['sprite'])
+            outputs.append(upload(s3, sprite_path, f"{name}/sprite.png"))
+            targets = [
+                f"sprite.png#xywh={(i % columns) * width},{(i // columns) * height},{width},{height}"
+                for i in range(len(paths))
+            ]
+
+        vtt_path = os.path.join(workdir, 'thumbnails.vtt')
+        with open(vtt_path, 'w') as fp:
+            fp.write(make_vtt(times, duration, targets))
+        outputs.append(upload(s3, vtt_path, f"{name}/thumbnails.vtt", 'text/vtt'))
+        return outputs
+
+def record_thumbnails(job, outputs):
+    # the upload function copies these next time the same content comes in
+    if not THUMBNAIL_INDEX_TABLE or not job.get('contentKey', None):
+        return
+    try:
+        boto3.client('dynamodb', region_name=AWS_REGION).put_item(
+            TableName=THUMBNAIL_INDEX_TABLE,
+            Item={
+                'contentKey': { 'S': job['contentKey'] },
+                'name': { 'S': job['name'] },
+                'outputs': { 'L': [ { 'S': output } for output in outputs ] },
+                'expiresAt': { 'N': str(int(time.time()) + THUMBNAIL_INDEX_TTL_DAYS * 24 * 3600) }
+            }
+        )
+    except Exception as e:
+        # the thumbnails are there all the same
+        print(json.dumps({"video": video_name(job), "status": "not indexed", "error": str(e)}))
+
+def video_name(job):
+    return f"s3://{job.get('bucket', '')}/{job.get('key', '')}"
+
+def run_job(s3, job):
+    try:
+        outputs = process(s3, job)
+        record_thumbnails(job, outputs)
+        locations = [ "s3://{}/{}".format(*output_key(output)) for output in outputs ]
+        print(json.dumps({"video": video_name(job), "status": "done", "thumbnails": locations}))
+        return True
+    except Exception as e:
+        print(json.dumps({"video": video_name(job), "status": "failed", "error": str(e)}))
+        return False
+
+def s3_client():
+    # SigV4, for the presigned URLs ffmpeg reads the videos from
+    return boto3.client('s3', region_name=AWS_REGION, config=Config(signature_version='s3v4'))
+
+def keep_invisible(sqs, queue_url, message, done):
+    """
+    Extend the visibility timeout of `message` every VISIBILITY_HEARTBEAT_SECONDS
+    until `done` is set, so that the queue does not hand the video to another
+    worker while this one is still at it. Stops after MAX_JOB_SECONDS, so that a
+    worker that hangs does not hold its message forever.
+    """
+    deadline = time.monotonic() + MAX_JOB_SECONDS
+    while not done.wait(VISIBILITY_HEARTBEAT_SECONDS) and time.monotonic() < deadline:
+        try:
+            sqs.change_message_visibility(
+                QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'],
+                VisibilityTimeout=QUEUE_VISIBILITY_SECONDS
+            )
+        except Exception as e:
+            # e.g. a throttled call: the next heartbeat comes well before the timeout
+            print(json.dumps({"message": message['MessageId'], "status": "not extended", "error": str(e)}))
+
+def consume(s3, queue_url):
+    sqs = boto3.client('sqs', region_name=AWS_REGION)
+
+    # ECS sends SIGTERM (to this process only, not to ffmpeg) when it stops the
+    # task, then SIGKILL after the container's stop timeout: finish the video at
+    # hand, then stop. One message at a time, so that no other is held meanwhile
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    while not stopping:
+        messages = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=20 # long polling
+        ).get('Messages', [])
+
+        for message in messages:
+            if stopping:
+                # received while stopping: give it back to the other workers right away
+                sqs.change_message_visibility(
+                    QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=0
+                )
+                continue
+            try:
+                job = json.loads(message['Body'])
+            except ValueError:
+                print(json.dumps({"message": message['MessageId'], "status": "failed", "error": "invalid job"}))
+                continue
+            done = threading.Event()
+            heartbeat = threading.Thread(target=keep_invisible, args=(sqs, queue_url, message, done), daemon=True)
+            heartbeat.start()
+            try:
+                succeeded = run_job(s3, job)
+            finally:
+                done.set()
+                heartbeat.join()
+            if succeeded:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+
+def main():
+    s3 = s3_client()
+
+    if THUMBNAIL_QUEUE_URL:
+        consume(s3, THUMBNAIL_QUEUE_URL)
+        return
+
+    jobs = json.loads(os.environ.get("THUMBNAIL_JOBS", "[]"))
+    results = [ run_job(s3, job) for job in jobs ]
+
+    sys.exit(0 if all(results) else 1)
+
+def lambda_handler(event, context):
+    s3 = s3_client()
+    results = [ run_job(s3, job) for job in event.get('jobs', []) ]
+    if not all(results):
+        # Lambda retries a failed asynchronous invocation twice
+        raise RuntimeError("some of the thumbnails failed, see the log above")
+
+if __name__ == '__main__':
+    main()
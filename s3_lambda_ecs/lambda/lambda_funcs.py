@@ -1,6 +1,10 @@
 import os
 import boto3
+import hashlib
 import json
+import time
+import urllib.parse
+from botocore.exceptions import ClientError
 
 ECS_CLUSTER_NAME = os.environ.get("ECS_CLUSTER_NAME")
 ECS_TASK_DEFINITION = os.environ.get("ECS_TASK_DEFINITION")
@@ -8,28 +12,280 @@ ECS_TASK_VPC_SUBNET_1 = os.environ.get("ECS_TASK_VPC_SUBNET_1")
 ECS_TASK_VPC_SUBNET_2 = os.environ.get("ECS_TASK_VPC_SUBNET_2")
 OUTPUT_S3_PATH = os.environ.get("OUTPUT_S3_PATH")
 OUTPUT_S3_AWS_REGION = os.environ.get("OUTPUT_S3_AWS_REGION")
+# set in queue mode: videos are queued for the worker service instead of starting tasks
+THUMBNAIL_QUEUE_URL = os.environ.get("THUMBNAIL_QUEUE_URL")
+# videos handled by one task, one after the other
+MAX_VIDEOS_PER_TASK = int(os.environ.get("MAX_VIDEOS_PER_TASK", "10"))
+# ECS rejects task overrides of more than 8192 characters
+MAX_OVERRIDES_CHARS = 8192
+# the frames to take from a video, unless its "thumbnails" metadata says otherwise (see frame_spec())
+THUMBNAIL_FRAMES = os.environ.get("THUMBNAIL_FRAMES", '{"positions": ["00:02"]}')
+MAX_FRAMES = 100
+# set when the stack has the Lambda path: videos up to FAST_PATH_MAX_BYTES go to that function
+FAST_PATH_FUNCTION = os.environ.get("FAST_PATH_FUNCTION")
+FAST_PATH_MAX_BYTES = int(os.environ.get("FAST_PATH_MAX_BYTES", "0"))
+# thumbnails made so far, by video content and frames (written by docker/thumbnail.py)
+THUMBNAIL_INDEX_TABLE = os.environ.get("THUMBNAIL_INDEX_TABLE")
+
+def s3_objects(event):
+    # an S3 notification may carry several records, and its keys are URL-encoded
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+        yield bucket, key
+
+def parse_position(position):
+    # "SS", "MM:SS" or "HH:MM:SS", with optional fractions of a second, or a number of seconds
+    if isinstance(position, (int, float)) and not isinstance(position, bool):
+        seconds = float(position)
+    elif isinstance(position, str) and 1 <= len(position.split(':')) <= 3:
+        seconds = 0.0
+        for part in position.split(':'):
+            seconds = seconds * 60 + float(part)
+    else:
+        raise ValueError(f"invalid position {position!r}")
+    if seconds < 0:
+        raise ValueError(f"invalid position {position!r}")
+    return seconds
+
+def frame_spec(spec):
+    """
+    Validate the frames to take from a video (JSON, from the stack or the
+    video's metadata), e.g.
+        {"positions": ["00:02", "01:30"]}, {"interval": 10} or {"scene": 0.4}
+    optionally with "sprite": true (or {"columns": 5, "width": 160}) for a
+    sprite sheet, and "maxFrames". Returns the form docker/thumbnail.py
+    takes. Raises ValueError.
+    """
+    if isinstance(spec, str):
+        spec = json.loads(spec)
+    if not isinstance(spec, dict):
+        raise ValueError("the frames must be a JSON object")
+
+    modes = [ mode for mode in ('positions', 'interval', 'scene') if mode in spec ]
+    if len(modes) != 1:
+        raise ValueError("the frames need exactly one of positions, interval or scene")
+
+    frames = {}
+    if 'positions' in spec:
+        if not isinstance(spec['positions'], list) or not 1 <= len(spec['positions']) <= MAX_FRAMES:
+            raise ValueError(f"positions must be a list of 1 to {MAX_FRAMES} times")
+        frames['positions'] = sorted(set(parse_position(position) for position in spec['positions']))
+    elif 'interval' in spec:
+        if not isinstance(spec['interval'], (int, float)) or spec['interval'] <= 0:
+            raise ValueError("interval must be a positive number of seconds")
+        frames['interval'] = spec['interval']
+    else:
+        if not isinstance(spec['scene'], (int, float)) or not 0 < spec['scene'] < 1:
+            raise ValueError("scene must be a threshold between 0 and 1")
+        frames['scene'] = spec['scene']
+
+    sprite = spec.get('sprite', None)
+    if sprite:
+        sprite = { 'columns': 5, 'width': 160, **(sprite if isinstance(sprite, dict) else {}) }
+        if not isinstance(sprite['columns'], int) or not 1 <= sprite['columns'] <= 20:
+            raise ValueError("sprite columns must be between 1 and 20")
+        if not isinstance(sprite['width'], int) or not 16 <= sprite['width'] <= 640:
+            raise ValueError("sprite width must be between 16 and 640 pixels")
+        frames['sprite'] = sprite
+
+    max_frames = spec.get('maxFrames', MAX_FRAMES)
+    if not isinstance(max_frames, int) or not 1 <= max_frames <= MAX_FRAMES:
+        raise ValueError(f"maxFrames must be between 1 and {MAX_FRAMES}")
+    frames['maxFrames'] = max_frames
+    return frames
+
+def thumbnail_job(s3, bucket, key):
+    # e.g. aws s3 cp video.mp4 s3://<bucket>/ --metadata '{"thumbnails": "{\"interval\": 10}"}'
+    head = s3.head_object(Bucket=bucket, Key=key)
+    frames = frame_spec(head.get('Metadata', {}).get('thumbnails', THUMBNAIL_FRAMES))
+    return {
+        # the worker reads the video with a presigned URL of its own: the bucket is not public
+        "bucket": bucket,
+        "key": key,
+        "name": os.path.splitext(key)[0],
+        "size": head['ContentLength'],
+        "frames": frames,
+        "contentKey": content_key(head['ETag'], head['ContentLength'], frames)
+    }
+
+def content_key(etag, size, frames):
+    # the same video (by its ETag) with the same frames gives the same thumbnails
+    digest = hashlib.sha256(f"{etag}:{size}:{json.dumps(frames, sort_keys=True)}".encode('utf-8'))
+    return digest.hexdigest()
+
+def reuse_thumbnails(s3, dynamodb, job):
+    """
+    If the thumbnails of the same content were made before, copy them to
+    the job's name. Returns the name they were copied from, or None if
+    the job has to be processed.
+    """
+    if not THUMBNAIL_INDEX_TABLE:
+        return None
+
+    entry = dynamodb.get_item(
+        TableName=THUMBNAIL_INDEX_TABLE,
+        Key={ 'contentKey': { 'S': job['contentKey'] } }
+    ).get('Item', None)
+    # DynamoDB deletes expired entries some time after they expire
+    if entry is None or int(entry['expiresAt']['N']) < time.time():
+        return None
+
+    source = entry['name']['S']
+    if source == job['name']:
+        return source # the same file uploaded again: its thumbnails are there already
+
+    bucket, _, prefix = OUTPUT_S3_PATH.partition('/')
+    def output_key(name, suffix):
+        return f"{prefix}/{name}{suffix}" if prefix else f"{name}{suffix}"
+    try:
+        for output in entry['outputs']['L']:
+            suffix = output['S'][len(source):] # e.g. ".png" or "/sprite.png"
+            s3.copy_object(
+                Bucket=bucket,
+                Key=output_key(job['name'], suffix),
+                CopySource={ 'Bucket': bucket, 'Key': output_key(source, suffix) }
+            )
+    except ClientError as e:
+        # e.g. the thumbnails were deleted since: make them again
+        log_outcome(job, "not reused", source=source, error=str(e))
+        return None
+    return source
+
+def group_jobs(jobs):
+    """
+    Split the jobs into the groups handled by one task each, within
+    MAX_VIDEOS_PER_TASK and the size limit of the task overrides.
+    """
+    group = []
+    for job in jobs:
+        # measured on the overrides sent: the jobs are JSON inside a JSON string there, escaped twice
+        if group and (len(group) >= MAX_VIDEOS_PER_TASK or len(json.dumps(task_overrides(group + [job]))) > MAX_OVERRIDES_CHARS):
+            yield group
+            group = []
+        group.append(job)
+    if group:
+        yield group
+
+def log_outcome(job, status, **details):
+    print(json.dumps({"video": f"s3://{job['bucket']}/{job['key']}", "status": status, **details}))
 
 def trigger_on_upload_video(event, context):
 
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+    s3 = boto3.client('s3')
+    # one client for all the records of the event, not one per video
+    dynamodb = boto3.client('dynamodb')
 
-    s3_video_url = f"https://s3.amazonaws.com/{bucket}/{key}"
-    thumbnail_file = os.path.splitext(key)[0] + ".png"
-    frame_pos = '00:02' # we use constant value here for demonstration
+    jobs = []
+    for (bucket, key) in s3_objects(event):
+        try:
+            job = thumbnail_job(s3, bucket, key)
+            source = reuse_thumbnails(s3, dynamodb, job)
+            if source is not None:
+                log_outcome(job, "reused", source=source)
+            else:
+                jobs.append(job)
+        except Exception as e:
+            log_outcome({ "bucket": bucket, "key": key }, "failed", error=str(e))
 
-    run_thumbnail_generate_task(s3_video_url, thumbnail_file, frame_pos)
+    # small videos take longer to get a Fargate task for than to process
+    if FAST_PATH_FUNCTION:
+        fast = [ job for job in jobs if job['size'] <= FAST_PATH_MAX_BYTES ]
+        jobs = [ job for job in jobs if job['size'] > FAST_PATH_MAX_BYTES ]
+        invoke_fast_path(fast)
 
-def trigger_on_thumbnail_creation(event, context):
+    # outcomes are logged per video; nothing is raised, as a retried event
+    # would queue or start the videos that did go through once more
+    if THUMBNAIL_QUEUE_URL:
+        queue_thumbnail_jobs(jobs)
+    else:
+        start_thumbnail_tasks(jobs)
+
+def invoke_fast_path(jobs):
+
+    client = boto3.client('lambda')
+
+    # one asynchronous invocation per video, so that they run side by side
+    for job in jobs:
+        try:
+            client.invoke(
+                FunctionName=FAST_PATH_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({"jobs": [job]})
+            )
+            log_outcome(job, "started", function=FAST_PATH_FUNCTION)
+        except Exception as e:
+            log_outcome(job, "failed", error=str(e))
+
+def queue_thumbnail_jobs(jobs):
+
+    client = boto3.client('sqs')
+
+    # one message per video, ten per call (the most SendMessageBatch takes)
+    for start in range(0, len(jobs), 10):
+        batch = jobs[start:start + 10]
+        try:
+            response = client.send_message_batch(
+                QueueUrl=THUMBNAIL_QUEUE_URL,
+                Entries=[ { 'Id': str(i), 'MessageBody': json.dumps(job) } for (i, job) in enumerate(batch) ]
+            )
+            for result in response.get('Successful', []):
+                log_outcome(batch[int(result['Id'])], "queued", message=result['MessageId'])
+            for result in response.get('Failed', []):
+                log_outcome(batch[int(result['Id'])], "failed", error=result.get('Message', result['Code']))
+        except Exception as e:
+            for job in batch:
+                log_outcome(job, "failed", error=str(e))
+
+def start_thumbnail_tasks(jobs):
 
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+    # one task per group of videos, instead of one per video
+    for group in group_jobs(jobs):
+        try:
+            response = run_thumbnail_generate_task(group)
+            failures = response.get('failures', [])
+            tasks = [ task['taskArn'] for task in response.get('tasks', []) ]
+            for job in group:
+                if tasks:
+                    log_outcome(job, "started", task=tasks[0])
+                else:
+                    log_outcome(job, "failed", failures=failures)
+        except Exception as e:
+            for job in group:
+                log_outcome(job, "failed", error=str(e))
+
+def trigger_on_thumbnail_creation(event, context):
 
     print(json.dumps(event))
-    print(f"A new thumbnail file was generated at 'https://s3.amazonaws.com/{bucket}/{key}'.")
+    for (bucket, key) in s3_objects(event):
+        print(f"A new thumbnail file was generated at 's3://{bucket}/{key}'.")
+
+def task_overrides(jobs):
+
+    return {
+        'containerOverrides': [
+            {
+                'name': 'ffmpeg-thumb',
+                'environment': [
+                    {
+                        'name': 'THUMBNAIL_JOBS',
+                        'value': json.dumps(jobs)
+                    },
+                    {
+                        'name': 'OUTPUT_S3_PATH',
+                        'value': OUTPUT_S3_PATH
+                    },
+                    {
+                        'name': 'AWS_REGION',
+                        'value': OUTPUT_S3_AWS_REGION
+                    }
+                ]
+            }
+        ]
+    }
+
+def run_thumbnail_generate_task(jobs):
 
-def run_thumbnail_generate_task(s3_video_url, thumbnail_file, frame_pos):
-    
     client = boto3.client('ecs')
 
     response = client.run_task(
@@ -47,36 +303,6 @@ def run_thumbnail_generate_task(s3_video_url, thumbnail_file, frame_pos):
                 'assignPublicIp': 'ENABLED'
                 }
         },
-        overrides={
-            'containerOverrides': [
-                {
-                    'name': 'ffmpeg-thumb',
-                    'environment': [
-                        {
-                            'name': 'INPUT_VIDEO_FILE_URL',
-                            'value': s3_video_url
-                        },
-                        {
-                            'name': 'OUTPUT_THUMBS_FILE_NAME',
-                            'value': thumbnail_file
-                        },
-                        {
-                            'name': 'POSITION_TIME_DURATION',
-                            'value': frame_pos
-                        },
-                        {
-                            'name': 'OUTPUT_S3_PATH',
-                            'value': OUTPUT_S3_PATH
-                        },
-                        {
-                            'name': 'AWS_REGION',
-                            'value': OUTPUT_S3_AWS_REGION
-                        }
-                    ]
-                }
-            ]
-        }
+        overrides=task_overrides(jobs)
     )
-
-    
-    
\ No newline at end of file
+    return response
@@ -1,3 +1,5 @@
+import json
+import os
 from aws_cdk import (
     core,
     aws_s3 as s3,
@@ -5,18 +7,24 @@ from aws_cdk import (
     aws_ecs as ecs,
     aws_iam as iam,
     aws_lambda as _lambda,
-    aws_lambda_event_sources as esources
+    aws_lambda_event_sources as esources,
+    aws_sqs as sqs,
+    aws_dynamodb as ddb,
+    aws_cloudwatch as cloudwatch,
+    aws_applicationautoscaling as appscaling
 )
 
 class MyStack(core.Stack):
 
-    def __init__(self, parent: core.App, name: str, **kwargs):
+    def __init__(self, parent: core.App, name: str, queue_mode: bool = False, max_workers: int = 10,
+                 thumbnails: dict = None, ffmpeg_layer_arn: str = None, fast_path_max_mb: int = 50,
+                 dedup_ttl_days: int = 30, **kwargs):
         super().__init__(parent, name, **kwargs)
         
         # prepare a S3 bucket to upload data
+        # not public: the workers read the videos with presigned URLs
         bucket = s3.Bucket(
             self, "DataBucket",
-            public_read_access=True,
             removal_policy=core.RemovalPolicy.DESTROY
         )
 
@@ -36,19 +44,135 @@ class MyStack(core.Stack):
             cpu=256 # meanining .25 vCPU
         )
 
-        # grant PUT operation to S3 bucket
+        # grant GET (the videos) and PUT (the thumbnails) operations to S3 bucket
+        bucket.grant_read(thumb_task_def.task_role)
         bucket.grant_write(thumb_task_def.task_role)
 
+        # thumbnails made so far, by video content and frames: an upload of
+        # the same content gets a copy of them instead of a new ffmpeg run
+        thumb_index = ddb.Table(
+            self, "ThumbnailIndex",
+            partition_key={
+                'name': 'contentKey',
+                'type': ddb.AttributeType.STRING
+            },
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute='expiresAt',
+            removal_policy=core.RemovalPolicy.DESTROY
+        )
+        thumb_index.grant_write_data(thumb_task_def.task_role)
+        thumb_index_env = {
+            "THUMBNAIL_INDEX_TABLE": thumb_index.table_name,
+            "THUMBNAIL_INDEX_TTL_DAYS": str(dedup_ttl_days)
+        }
+
+        # in queue mode, uploads are queued by the Lambda function, and a
+        # service of long-running workers makes the thumbnails
+        if queue_mode:
+            queue_visibility_seconds = 300
+            dead_letter_queue = sqs.Queue(
+                self, "ThumbnailDeadLetterQueue",
+                retention_period=core.Duration.days(14)
+            )
+            queue = sqs.Queue(
+                self, "ThumbnailQueue",
+                # how long a message waits after a worker stopped renewing it (see
+                # keep_invisible() in docker/thumbnail.py, which gets it as
+                # QUEUE_VISIBILITY_SECONDS), not how long a video may take
+                visibility_timeout=core.Duration.seconds(queue_visibility_seconds),
+                # a video that fails three times goes to the dead-letter queue
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=dead_letter_queue)
+            )
+            queue.grant_consume_messages(thumb_task_def.task_role)
+            core.CfnOutput(self, 'DeadLetterQueue', value=dead_letter_queue.queue_url)
+
         thumb_container = thumb_task_def.add_container(
             'ffmpeg-thumb',
-            image=ecs.ContainerImage.from_registry('rupakg/docker-ffmpeg-thumb'),
-            logging=ecs.LogDriver.aws_logs(stream_prefix="ffmpeg-thumb")
+            # our own ffmpeg image, which handles several videos per task (see docker/thumbnail.py)
+            image=ecs.ContainerImage.from_asset(
+                os.path.join(os.path.dirname(__file__), "docker")
+            ),
+            # the per-task mode passes the videos and settings as overrides instead
+            environment={
+                **thumb_index_env,
+                "THUMBNAIL_QUEUE_URL": queue.queue_url,
+                "QUEUE_VISIBILITY_SECONDS": str(queue_visibility_seconds),
+                "OUTPUT_S3_PATH": bucket.bucket_name + '/thumb',
+                "AWS_REGION": 'us-east-1'
+            } if queue_mode else thumb_index_env,
+            logging=ecs.LogDriver.aws_logs(stream_prefix="ffmpeg-thumb"),
+            # on a stop, a worker finishes the video at hand before it exits (the most Fargate allows)
+            stop_timeout=core.Duration.seconds(120)
         )
 
         thumb_container.add_port_mappings(
             ecs.PortMapping(container_port=8081)
         )
 
+        if queue_mode:
+            thumb_service = ecs.FargateService(
+                self, "ffmpeg-thumb-service",
+                cluster=cluster,
+                task_definition=thumb_task_def,
+                desired_count=0
+            )
+
+            # scale out on the queue backlog, by more tasks as it grows
+            scaling = thumb_service.auto_scale_task_count(min_capacity=0, max_capacity=max_workers)
+            scaling.scale_on_metric(
+                'QueueBacklogScaling',
+                metric=queue.metric_approximate_number_of_messages_visible(),
+                adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                scaling_steps=[
+                    appscaling.ScalingInterval(lower=1, change=+1),
+                    appscaling.ScalingInterval(lower=100, change=+3),
+                    appscaling.ScalingInterval(lower=500, change=+5)
+                ]
+            )
+
+            # scale in, down to zero, only once no message is waiting nor being
+            # processed: the visible count drops to 0 as soon as the last ones are received
+            scale_in = appscaling.StepScalingAction(
+                self, "QueueDrainedScaling",
+                # the ScalableTarget behind the task count
+                scaling_target=scaling.node.find_child('Target'),
+                adjustment_type=appscaling.AdjustmentType.EXACT_CAPACITY,
+                metric_aggregation_type=appscaling.MetricAggregationType.MAXIMUM
+            )
+            scale_in.add_adjustment(adjustment=0, upper_bound=0)
+
+            def queue_metric(id, metric_name):
+                return cloudwatch.CfnAlarm.MetricDataQueryProperty(
+                    id=id,
+                    return_data=False,
+                    metric_stat=cloudwatch.CfnAlarm.MetricStatProperty(
+                        metric=cloudwatch.CfnAlarm.MetricProperty(
+                            namespace='AWS/SQS',
+                            metric_name=metric_name,
+                            dimensions=[cloudwatch.CfnAlarm.DimensionProperty(name='QueueName', value=queue.queue_name)]
+                        ),
+                        period=60,
+                        stat='Maximum'
+                    )
+                )
+
+            # the metric math of this alarm is not in the Alarm construct of this CDK version
+            cloudwatch.CfnAlarm(
+                self, "QueueDrainedAlarm",
+                alarm_description="No thumbnail job is waiting or in progress",
+                comparison_operator='LessThanOrEqualToThreshold',
+                threshold=0,
+                evaluation_periods=5,
+                alarm_actions=[scale_in.scaling_policy_arn],
+                metrics=[
+                    queue_metric('visible', 'ApproximateNumberOfMessagesVisible'),
+                    queue_metric('inFlight', 'ApproximateNumberOfMessagesNotVisible'),
+                    cloudwatch.CfnAlarm.MetricDataQueryProperty(
+                        id='total', expression='visible + inFlight', label='Jobs', return_data=True
+                    )
+                ]
+            )
+
         # set environmental variable for this lambda
         on_upload_video_env = {
             "ECS_CLUSTER_NAME": cluster.cluster_name,
@@ -56,8 +180,38 @@ class MyStack(core.Stack):
             "ECS_TASK_VPC_SUBNET_1": vpc.private_subnets[0].subnet_id,
             "ECS_TASK_VPC_SUBNET_2": vpc.private_subnets[1].subnet_id,
             "OUTPUT_S3_PATH": bucket.bucket_name + '/thumb',
-            "OUTPUT_S3_AWS_REGION": 'us-east-1'
+            "OUTPUT_S3_AWS_REGION": 'us-east-1',
+            "MAX_VIDEOS_PER_TASK": '10',
+            "THUMBNAIL_INDEX_TABLE": thumb_index.table_name
         }
+        if queue_mode:
+            on_upload_video_env["THUMBNAIL_QUEUE_URL"] = queue.queue_url
+        # the frames to take from each video (see frame_spec() in lambda/lambda_funcs.py)
+        if thumbnails is not None:
+            on_upload_video_env["THUMBNAIL_FRAMES"] = json.dumps(thumbnails)
+
+        # with an ffmpeg layer, small videos are processed in a Lambda
+        # function instead, with the worker's code (docker/thumbnail.py)
+        if ffmpeg_layer_arn is not None:
+            fast_thumb = _lambda.Function(
+                self, 'fastThumbnailFunction',
+                code=_lambda.AssetCode('./docker'),
+                handler='thumbnail.lambda_handler',
+                runtime=_lambda.Runtime.PYTHON_3_7,
+                layers=[_lambda.LayerVersion.from_layer_version_arn(self, 'FfmpegLayer', ffmpeg_layer_arn)],
+                memory_size=2048, # ffmpeg gets CPU in proportion
+                timeout=core.Duration.minutes(5),
+                environment={
+                    **thumb_index_env,
+                    "OUTPUT_S3_PATH": bucket.bucket_name + '/thumb'
+                }
+            )
+            bucket.grant_read(fast_thumb)
+            bucket.grant_write(fast_thumb)
+            thumb_index.grant_write_data(fast_thumb)
+            on_upload_video_env["FAST_PATH_FUNCTION"] = fast_thumb.function_name
+            on_upload_video_env["FAST_PATH_MAX_BYTES"] = str(fast_path_max_mb * 1024 * 1024)
+
         # define lambda function
         on_upload_video = _lambda.Function(
             self, 'onVideoUploadFunction',
@@ -69,6 +223,13 @@ class MyStack(core.Stack):
         
         # grant read permission
         bucket.grant_read(on_upload_video)
+        # the function copies existing thumbnails itself
+        bucket.grant_put(on_upload_video, 'thumb/*')
+        thumb_index.grant_read_data(on_upload_video)
+        if queue_mode:
+            queue.grant_send_messages(on_upload_video)
+        if ffmpeg_layer_arn is not None:
+            fast_thumb.grant_invoke(on_upload_video)
         # gran permission to execute ECS jobs
         on_upload_video.add_to_role_policy(
             iam.PolicyStatement(